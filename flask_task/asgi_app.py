@@ -0,0 +1,627 @@
+from functools import wraps
+from quart import (
+    Blueprint,
+    Quart,
+    Response,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    request,
+)
+from quart.wrappers.response import DataBody
+from limits import parse_many
+from limits.storage import MemoryStorage, storage_from_string
+from limits.strategies import STRATEGIES
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm.exc import StaleDataError
+from compression import (
+    compressible,
+    make_compressor,
+    negotiate_encoding,
+    weaken_etag,
+)
+from config import load_config
+from db_util import db
+from db_routing import (
+    is_read_request,
+    pick_replica,
+    pin_to_primary,
+    read_only,
+    user_cache_modes,
+)
+from db_pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool, pool_stats
+from etags import USERS_VERSION_QUERY, list_etag
+from json_provider import init_json_provider
+from log_setup import configure_logging
+from keyset import KeysetError
+from schema import upgrade_schema
+from search_index import setup_search_index
+from user_api import (
+    REQUEST_ERRORS,
+    SNAPSHOT_DISABLED,
+    batch_response,
+    check_write_payload,
+    parse_analytics_request,
+    parse_batch_request,
+    parse_export_request,
+    parse_list_request,
+    parse_lookup_request,
+    parse_user_request,
+    user_body,
+)
+from serializers import USER_FIELDS
+from user_batch import run_chunk, to_values
+from user_export import encode_rows, export_header, export_headers
+from user_cache import init_user_cache
+from user_counts import init_count_cache
+from user_queries import fetch_user, fetch_user_list, fetch_users_by_ids
+from user_snapshot import init_user_snapshot
+from user_stats import read_summary
+from user_writes import delete_user_row, insert_user, update_user_row
+import limiter_storage  # noqa: F401 - registers the sqlite:// limits storage
+import asyncio
+import logging
+
+# Async serving mode: the same /api/v1 surface as routes.py on Quart and an
+# async SQLAlchemy engine, so a worker keeps serving while queries wait on
+# the database. Run with an ASGI server, e.g. `uvicorn asgi_app:app`.
+# Query building, validation, the rollup and batch logic are shared with the
+# WSGI app (user_api.py, user_queries.py, user_writes.py, user_batch.py);
+# this module only adds the session and await layer, running the shared sync
+# functions through AsyncSession.run_sync. Calls into the SQLite user cache
+# and rate limit storage, which block on file I/O and locks, run in worker
+# threads so they do not stall the event loop.
+
+logger = logging.getLogger(__name__)
+async_api_routes = Blueprint("async_api_routes", __name__, url_prefix="/api/v1")
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url):
+    # Map a sync DATABASE_URL (sqlite:///..., postgresql://...) to its async driver
+    scheme, sep, rest = url.partition("://")
+    scheme = ASYNC_DRIVERS.get(scheme.split("+")[0], scheme)
+    return f"{scheme}{sep}{rest}"
+
+
+def async_engine_options(config, url):
+    options = dict(config["SQLALCHEMY_ENGINE_OPTIONS"])
+    if options.get("poolclass") is InstrumentedQueuePool:
+        options["poolclass"] = InstrumentedAsyncQueuePool
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            "prepared_statement_cache_size": config["DB_STATEMENT_CACHE_SIZE"]
+        }
+    return options
+
+
+def session_factory():
+    # The replica sessionmaker chosen for this request, else the primary's
+    replica = g.get("db_replica")
+    if replica is not None:
+        return current_app.extensions["async_read_sessions"][replica]
+    return current_app.extensions["async_session"]
+
+
+def get_session():
+    return session_factory()()
+
+
+def current_view():
+    return current_app.view_functions.get(request.endpoint)
+
+
+async def choose_database():
+    # Same routing as db_routing.choose_database, per session instead of
+    # per statement: no GET handler here writes
+    g.db_replica = pick_replica(
+        current_app.extensions["db_replicas"],
+        current_view(),
+        request.method,
+        request.cookies,
+    )
+
+
+async def pin_writer(response):
+    if (
+        not is_read_request(current_view(), request.method)
+        and response.status_code < 400
+    ):
+        pin_to_primary(response, current_app.config["DB_REPLICA_STICKY_SECONDS"])
+    return response
+
+
+async def off_loop(blocking, fn, *args):
+    # Call fn in a worker thread when it may block on I/O or a lock, so the
+    # event loop keeps serving other requests meanwhile
+    if blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def get_cache():
+    return current_app.extensions.get("user_cache")
+
+
+async def invalidate_users(*user_ids):
+    cache = get_cache()
+    if cache:
+        await off_loop(cache.blocking, cache.invalidate, user_ids)
+
+
+def export_encoding():
+    # Negotiated Content-Encoding for a streamed export, or None
+    if not current_app.config["COMPRESSION_ENABLED"]:
+        return None
+    return negotiate_encoding(request.accept_encodings)
+
+
+async def compress_response(response):
+    # Same rules as compression.compress_response for buffered bodies;
+    # streamed routes (the export) compress their own chunks
+    if not isinstance(response.response, DataBody) or not compressible(response):
+        return response
+    data = await response.get_data()
+    if len(data) < current_app.config["COMPRESSION_MIN_SIZE"]:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    compressor = make_compressor(encoding, current_app.config)
+    response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    weaken_etag(response)
+    return response
+
+
+def exceeded_limit(limiter, limits, key):
+    # The first of limits that key has used up, or None
+    for item in limits:
+        if not limiter.hit(item, *key):
+            return item
+    return None
+
+
+def rate_limit(spec):
+    # Same limit strings and storage as the Flask-Limiter decorators
+    limits = parse_many(spec)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get("rate_limiter")
+            if limiter:
+                key = (request.remote_addr or "127.0.0.1", request.endpoint)
+                item = await off_loop(
+                    current_app.extensions["rate_limiter_blocking"],
+                    exceeded_limit,
+                    limiter,
+                    limits,
+                    key,
+                )
+                if item is not None:
+                    return jsonify({"error": f"Rate limit exceeded: {item}"}), 429
+            return await view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def not_modified(etag):
+    if etag and request.if_none_match.contains_weak(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+    return None
+
+
+async def with_etag(body, etag, status=200):
+    response = await make_response(jsonify(body), status)
+    response.set_etag(etag)
+    return response
+
+
+async def users_version(session):
+    return (await session.execute(USERS_VERSION_QUERY)).scalar() or 0
+
+
+# User_controller
+@async_api_routes.route("/test")
+@rate_limit("5/minute")
+async def test_handler():
+    logger.info("test route successfull")
+    return "user controller route!"
+
+
+@async_api_routes.route("/users", methods=["GET"])
+@rate_limit("100/hour;5/minute")
+async def get_users():
+    try:
+        params = parse_list_request(request.args, current_app.config)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache = get_cache()
+    try:
+        async with get_session() as session:
+            version = await users_version(session)
+            etag = list_etag(request.args, version)
+            unchanged = not_modified(etag)
+            if unchanged:
+                return unchanged
+
+            if cache:
+                cache_key = cache.list_key(request.args, version)
+                body = await off_loop(cache.blocking, cache.get_list, cache_key)
+                if body is not None:
+                    return await with_etag(body, etag)
+
+            body = await session.run_sync(
+                fetch_user_list,
+                params,
+                current_app.config["USER_MULTIGET_CHUNK_SIZE"],
+                current_app.extensions["user_search"],
+                current_app.extensions["user_counts"],
+            )
+    except KeysetError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error fetching users: %s", e)
+        return jsonify({"error": "Failed to fetch users"}), 500
+
+    if cache:
+        await off_loop(cache.blocking, cache.set_list, cache_key, body)
+    return await with_etag(body, etag)
+
+
+@async_api_routes.route("/users/lookup", methods=["POST"])
+@read_only
+@rate_limit("100/hour;5/minute")
+async def lookup_users():
+    try:
+        ids, fields = parse_lookup_request(
+            request.args, await request.get_json(silent=True), current_app.config
+        )
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        async with get_session() as session:
+            result = await session.run_sync(
+                fetch_users_by_ids,
+                ids,
+                current_app.config["USER_MULTIGET_CHUNK_SIZE"],
+                fields,
+            )
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error("Error looking up users: %s", e)
+        return jsonify({"error": "Failed to fetch users"}), 500
+
+
+@async_api_routes.route("/users/<int:id>", methods=["GET"])
+@rate_limit("5/minute")
+async def get_user_by_id(id):
+    try:
+        fields = parse_user_request(request.args)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache = get_cache()
+    lookup, fill = user_cache_modes(g.get("db_replica"), request.cookies)
+    fill = cache and fill
+    if fill:
+        generation = await off_loop(cache.blocking, cache.generation)
+    entry = None
+    if cache and lookup:
+        entry = await off_loop(cache.blocking, cache.get_user, id)
+
+    if entry is None:
+        try:
+            # The cache holds full users, so only a read that does not fill
+            # it is narrowed
+            async with get_session() as session:
+                entry = await session.run_sync(
+                    fetch_user, id, USER_FIELDS if fill else fields
+                )
+        except Exception as e:
+            logger.error("Error fetching user %s: %s", id, e)
+            return jsonify({"error": f"Failed to get user: {str(e)}"}), 500
+        if entry is None:
+            logger.error("Failed to fetch user with id: %s", id)
+            return jsonify({"error": "User not found"}), 404
+        if fill:
+            await off_loop(cache.blocking, cache.set_user, id, entry, generation)
+
+    body, etag = user_body(entry, fields)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    return await with_etag(body, etag)
+
+
+@async_api_routes.route("/users", methods=["POST"])
+async def create_user():
+    try:
+        data = await request.get_json()
+        logger.info("Creating user with JSON payload received")
+
+        broken_payload = check_write_payload(data, full=True)
+        if broken_payload:
+            return jsonify(broken_payload), 400
+
+        async with get_session() as session:
+            user, etag = await session.run_sync(insert_user, to_values(data, full=True))
+            await session.commit()
+        await invalidate_users()
+
+        logger.info("User created succcessfully. ID:%s", user["id"])
+        return await with_etag({"data": user}, etag, 201)
+
+    except Exception as e:
+        logger.error("Error creating new user: %s", e)
+        return jsonify({"error": f"Failed to create new user: {str(e)}"}), 500
+
+
+async def write_user(id, full):
+    try:
+        data = await request.get_json()
+        broken_payload = check_write_payload(data, full)
+        if broken_payload:
+            return jsonify(broken_payload), 400
+
+        # Leaving the session without a commit rolls it back
+        async with get_session() as session:
+            result = await session.run_sync(
+                update_user_row, id, to_values(data, full), request.if_match
+            )
+            if result:
+                await session.commit()
+        if result is None:
+            logger.warning("User not found. ID: %s", id)
+            return jsonify({"error": "User not found"}), 404
+        if result is False:
+            return jsonify({"error": "User was modified (ETag mismatch)"}), 412
+
+        await invalidate_users(id)
+        logger.info("User update successfull")
+        user, etag = result
+        return await with_etag({"data": user}, etag)
+
+    except StaleDataError:
+        logger.warning("Concurrent update of user %s rejected", id)
+        return jsonify({"error": "User was modified concurrently"}), 409
+
+    except Exception as e:
+        logger.error("Error updating user %s: %s", id, e)
+        return jsonify({"error": f"Failed to update user: {str(e)}"}), 500
+
+
+@async_api_routes.route("/users/<int:id>", methods=["PUT"])
+async def update_user(id):
+    return await write_user(id, full=True)
+
+
+@async_api_routes.route("/users/<int:id>", methods=["PATCH"])
+async def partial_update_user(id):
+    return await write_user(id, full=False)
+
+
+@async_api_routes.route("/users/<int:id>", methods=["DELETE"])
+async def delete_user(id):
+    try:
+        async with get_session() as session:
+            deleted = await session.run_sync(delete_user_row, id)
+            if deleted:
+                await session.commit()
+        if not deleted:
+            logger.warning("User not found. ID: %s", id)
+            return jsonify({"message": "User not found"}), 404
+
+        await invalidate_users(id)
+        return jsonify({"message": "User deleted successfully"}), 200
+
+    except Exception as e:
+        logger.error("Error deleting user %s: %s", id, e)
+        return jsonify({"error": f"Failed to delete user: {str(e)}"}), 500
+
+
+@async_api_routes.route("/users/batch", methods=["POST"])
+async def batch_users():
+    operations = await request.get_json(silent=True)
+    try:
+        results, valid, chunk_size = parse_batch_request(
+            operations, request.args, current_app.config
+        )
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Same chunking as user_batch.run_batch, one session per chunk
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start : start + chunk_size]
+        try:
+            async with get_session() as session:
+                chunk_results, changed_ids = await session.run_sync(run_chunk, chunk)
+                await session.commit()
+            await invalidate_users(*changed_ids)
+            results.update(chunk_results)
+        except Exception as e:
+            logger.error("Error applying batch chunk at item %s: %s", chunk[0][0], e)
+            for index, _ in chunk:
+                results[index] = {"status": 500, "error": "Chunk rolled back"}
+    logger.info(
+        "Batch processed: %s of %s operations valid", len(valid), len(operations)
+    )
+    return jsonify(batch_response(operations, results)), 200
+
+
+@async_api_routes.route("/users/export", methods=["GET"])
+@rate_limit("10/hour")
+async def export_users():
+    try:
+        fmt, fields, query = parse_export_request(
+            request.args, current_app.extensions["user_search"]
+        )
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    batch_size = current_app.config["USER_EXPORT_BATCH_SIZE"]
+    sessionmaker = session_factory()
+    encoding = export_encoding()
+    compressor = make_compressor(encoding, current_app.config) if encoding else None
+
+    async def chunks():
+        async with sessionmaker() as session:
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            header = export_header(fmt, fields)
+            yield compressor.compress(header) if compressor else header
+            async for rows in result.partitions():
+                data = encode_rows(rows, fmt, fields)
+                yield compressor.compress(data) if compressor else data
+        if compressor:
+            yield compressor.flush()
+
+    mimetype, headers = export_headers(fmt)
+    if compressor:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+
+    logger.info("Exporting users as %s", fmt)
+    return Response(chunks(), mimetype=mimetype, headers=headers)
+
+
+@async_api_routes.route("/cache/stats", methods=["GET"])
+async def get_cache_stats():
+    cache = get_cache()
+    stats = await off_loop(cache.blocking, cache.stats) if cache else None
+    return jsonify({"data": stats}), 200
+
+
+@async_api_routes.route("/pool/stats", methods=["GET"])
+async def get_pool_stats():
+    engine = current_app.extensions["async_engine"]
+    data = pool_stats(engine.sync_engine)
+    replicas = current_app.extensions["async_replica_engines"]
+    if replicas:
+        data["replicas"] = {
+            key: pool_stats(replica.sync_engine) for key, replica in replicas.items()
+        }
+    return jsonify({"data": data}), 200
+
+
+@async_api_routes.route("/users/summary", methods=["GET"])
+@rate_limit("5/minute")
+async def get_statistics():
+    async with get_session() as session:
+        summary = await session.run_sync(read_summary)
+    return jsonify({"data": summary}), 200
+
+
+@async_api_routes.route("/users/analytics", methods=["GET"])
+@rate_limit("5/minute")
+async def get_analytics():
+    snapshot = current_app.extensions["user_snapshot"]
+    if snapshot is None:
+        return jsonify({"error": SNAPSHOT_DISABLED}), 503
+    try:
+        filters, group_by, bin_width = parse_analytics_request(request.args)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The snapshot's own lock would block the event loop while a refresh
+    # awaits the database, so refreshes queue on an asyncio lock instead
+    async with current_app.extensions["user_snapshot_lock"]:
+        async with get_session() as session:
+            await session.run_sync(snapshot.refresh)
+    data = snapshot.analyze(filters, group_by, bin_width)
+    return jsonify({"data": data, "snapshot": snapshot.stats()}), 200
+
+
+def create_app():
+    # The ASGI app expects an existing database: seed it with `python main.py`
+    # or `python populate_db.py` first
+    configure_logging()
+    app = Quart(__name__)
+    load_config(app)
+
+    init_json_provider(app, app.config["JSON_PROVIDER"])
+    init_user_cache(app)
+    init_count_cache(app)
+    init_user_snapshot(app)
+    app.extensions["user_snapshot_lock"] = asyncio.Lock()
+
+    url = async_database_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    engine = create_async_engine(url, **async_engine_options(app.config, url))
+    app.extensions["async_engine"] = engine
+    app.extensions["async_session"] = async_sessionmaker(engine, expire_on_commit=False)
+
+    replicas = {}
+    for key, bind in sorted(app.config["SQLALCHEMY_BINDS"].items()):
+        replica_url = async_database_url(bind["url"])
+        replicas[key] = create_async_engine(
+            replica_url, **async_engine_options(app.config, replica_url)
+        )
+    app.extensions["async_replica_engines"] = replicas
+    app.extensions["async_read_sessions"] = {
+        key: async_sessionmaker(replica, expire_on_commit=False)
+        for key, replica in replicas.items()
+    }
+    app.extensions["db_replicas"] = list(replicas)
+    if replicas:
+        app.before_request(choose_database)
+        if app.config["DB_REPLICA_STICKY_SECONDS"] > 0:
+            app.after_request(pin_writer)
+        logger.info("Routing reads to %d replica(s)", len(replicas))
+
+    if app.config["RATELIMIT_ENABLED"]:
+        storage = storage_from_string(app.config["RATELIMIT_STORAGE_URI"])
+        strategy = STRATEGIES[app.config["RATELIMIT_STRATEGY"]]
+        app.extensions["rate_limiter"] = strategy(storage)
+        # The sqlite:// storage has no limits.aio counterpart, so hits on any
+        # storage but the in-process one run in a worker thread
+        app.extensions["rate_limiter_blocking"] = not isinstance(storage, MemoryStorage)
+
+    @app.before_serving
+    async def startup():
+        async with engine.begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+            await conn.run_sync(upgrade_schema)
+        try:
+            async with engine.begin() as conn:
+                backend = await conn.run_sync(setup_search_index)
+        except SQLAlchemyError as e:
+            logger.warning("Trigram search index unavailable, using table scans: %s", e)
+            backend = "scan"
+        app.extensions["user_search"] = backend
+        logger.info("User search backend: %s", backend)
+
+    @app.after_serving
+    async def shutdown():
+        await engine.dispose()
+        for replica in replicas.values():
+            await replica.dispose()
+
+    if app.config["COMPRESSION_ENABLED"]:
+        app.after_request(compress_response)
+    app.register_blueprint(async_api_routes)
+
+    @app.route("/")
+    async def home():
+        return "Welcome to Flask API!"
+
+    @app.route("/health_check")
+    async def health_check():
+        return {"message": "Health check successful"}
+
+    return app
+
+
+app = create_app()
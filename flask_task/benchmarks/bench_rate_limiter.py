@@ -0,0 +1,83 @@
+"""Measure rate limiter overhead per request and cross-process correctness.
+
+Usage: python benchmarks/bench_rate_limiter.py [--hits 20000] [--workers 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import parse  # noqa: E402
+from limits.storage import storage_from_string  # noqa: E402
+from limits.strategies import STRATEGIES  # noqa: E402
+import limiter_storage  # noqa: E402,F401
+
+
+def per_hit_us(uri, strategy, hits):
+    storage = storage_from_string(uri)
+    limiter = STRATEGIES[strategy](storage)
+    item = parse(f"{hits * 10}/minute")
+    limiter.hit(item, "warmup")
+
+    start = time.perf_counter()
+    for i in range(hits):
+        limiter.hit(item, "bench", str(i % 100))
+    return (time.perf_counter() - start) / hits * 1e6
+
+
+def hammer(uri, strategy, limit, hits, results):
+    storage = storage_from_string(uri)
+    limiter = STRATEGIES[strategy](storage)
+    item = parse(f"{limit}/hour")
+    results.put(sum(limiter.hit(item, "shared") for _ in range(hits)))
+
+
+def allowed_across_workers(uri, strategy, workers, limit, hits):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=hammer, args=(uri, strategy, limit, hits, results)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    allowed = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hits", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'storage':<10} {'strategy':<14} {'us/hit':>8} {'allowed':>12}")
+        for name, uri in (
+            ("memory", "memory://"),
+            ("sqlite", f"sqlite:///{os.path.join(tmp, 'ratelimit.db')}"),
+        ):
+            for strategy in ("fixed-window", "moving-window"):
+                us = per_hit_us(uri, strategy, args.hits)
+                # Each worker tries to take the whole limit; a shared storage
+                # lets exactly --limit hits through in total
+                allowed = allowed_across_workers(
+                    uri, strategy, args.workers, args.limit, args.limit
+                )
+                print(
+                    f"{name:<10} {strategy:<14} {us:8.1f} "
+                    f"{allowed:>6}/{args.limit:<5}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Compare the ORM + stdlib JSON list path with Core rows + orjson.
+
+Usage: python benchmarks/bench_serialization.py [--rows 20000] [--page 500]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from db_util import db  # noqa: E402
+from json_provider import OrjsonProvider, orjson  # noqa: E402
+from models import User  # noqa: E402
+from serializers import USER_COLUMNS, serialize_rows  # noqa: E402
+
+
+def legacy_dict(user):
+    # The hand-built dict the handlers used before serializers.py
+    return {
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "company_name": user.company_name,
+        "city": user.city,
+        "state": user.state,
+        "zip": user.zip,
+        "email": user.email,
+        "web": user.web,
+        "age": user.age,
+    }
+
+
+def make_app(path, rows):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "first_name": f"First{i}",
+                    "last_name": f"Last{i}",
+                    "company_name": f"Company {i % 997}",
+                    "city": f"City{i % 1500}",
+                    "state": f"S{i % 50}",
+                    "zip": 10000 + i % 89999,
+                    "email": f"user{i}@example.com",
+                    "web": f"http://www.company{i % 997}.com",
+                    "age": 18 + i % 80,
+                }
+                for i in range(rows)
+            ],
+        )
+        db.session.commit()
+    return app
+
+
+def orm_page(app, page_size):
+    users = db.session.query(User).order_by(User.id).limit(page_size).all()
+    return app.json.response({"data": [legacy_dict(user) for user in users]})
+
+
+def core_page(app, page_size):
+    rows = db.session.execute(
+        db.select(*USER_COLUMNS).order_by(User.id).limit(page_size)
+    ).all()
+    return app.json.response({"data": serialize_rows(rows)})
+
+
+def measure(app, provider, fn, page_size, number):
+    app.json = provider(app)
+    with app.app_context():
+
+        def run():
+            fn(app, page_size)
+            db.session.remove()
+
+        run()
+        best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"), args.rows)
+        cases = [("ORM objects + stdlib json", DefaultJSONProvider, orm_page)]
+        cases.append(("Core rows + stdlib json", DefaultJSONProvider, core_page))
+        if orjson is not None:
+            cases.append(("Core rows + orjson", OrjsonProvider, core_page))
+        else:
+            print("orjson not installed; skipping the orjson case")
+
+        print(f"{args.page} rows per page, best of 5 x {args.number} runs")
+        baseline = None
+        for name, provider, fn in cases:
+            ms = measure(app, provider, fn, args.page, args.number)
+            baseline = baseline or ms
+            print(f"{name:<28} {ms:8.3f} ms/page  {baseline / ms:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Compare the columnar user snapshot with the users table and ORM objects.
+
+Reports the snapshot's memory next to the same users loaded as ORM objects
+and as rows of the snapshot's columns (measured with tracemalloc), the time
+of aggregate queries in SQL and on the snapshot, and the cost of a first
+load and of refreshes after a few writes. Needs numpy.
+
+Usage: python benchmarks/bench_snapshot.py [--rows 100000] [--repeat 20]
+       [--database-url postgresql://...]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import func, insert, select, update  # noqa: E402
+from db_util import db  # noqa: E402
+from etags import bump_users_version  # noqa: E402
+from models import User  # noqa: E402
+from user_snapshot import SNAPSHOT_COLUMNS, UserSnapshot  # noqa: E402
+
+
+def make_app(url, rows):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    db.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "first_name": f"First{i}",
+                    "last_name": f"Last{i}",
+                    "company_name": f"Company {i % 997}",
+                    "city": f"City{i % 1500}",
+                    "state": f"S{i % 50}",
+                    "zip": 10000 + i % 89999,
+                    "email": f"user{i}@example.com",
+                    "web": f"http://www.company{i % 997}.com",
+                    "age": 18 + i % 80,
+                }
+                for i in range(rows)
+            ],
+        )
+        bump_users_version(conn=db.session)
+        db.session.commit()
+    return app
+
+
+def allocated(load):
+    # Bytes still allocated by what load() returns
+    gc.collect()
+    tracemalloc.start()
+    kept = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def write_and_refresh(snapshot, statement):
+    db.session.execute(statement)
+    bump_users_version(conn=db.session)
+    db.session.commit()
+    started = time.perf_counter()
+    snapshot.refresh(db.session)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", help="scratch database; it is wiped")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = make_app(url, args.rows)
+        with app.app_context():
+            session = db.session
+            snapshot = UserSnapshot()
+            started = time.perf_counter()
+            snapshot.refresh(session)
+            first_load = (time.perf_counter() - started) * 1000
+
+            print(f"{args.rows} users on {db.engine.dialect.name}")
+            print("\nmemory")
+            print(f"  {'snapshot':<36} {snapshot.nbytes() / 1e6:8.1f} MB")
+            orm = allocated(lambda: session.execute(select(User)).scalars().all())
+            session.expunge_all()
+            print(f"  {'ORM User objects':<36} {orm / 1e6:8.1f} MB")
+            rows = allocated(lambda: session.execute(select(*SNAPSHOT_COLUMNS)).all())
+            print(f"  {'rows of the snapshot columns':<36} {rows / 1e6:8.1f} MB")
+
+            queries = [
+                (
+                    "count by state",
+                    lambda: session.execute(
+                        select(User.state, func.count()).group_by(User.state)
+                    ).all(),
+                    lambda: snapshot.analyze({}, "state"),
+                ),
+                (
+                    "count by city, state=S7",
+                    lambda: session.execute(
+                        select(User.city, func.count())
+                        .where(User.state == "S7")
+                        .group_by(User.city)
+                    ).all(),
+                    lambda: snapshot.analyze({"state": "S7"}, "city"),
+                ),
+                (
+                    "age min/max/avg, age 30-40",
+                    lambda: session.execute(
+                        select(
+                            func.min(User.age), func.max(User.age), func.avg(User.age)
+                        ).where(User.age.between(30, 40))
+                    ).one(),
+                    lambda: snapshot.analyze({"age_min": 30, "age_max": 40}),
+                ),
+            ]
+            print(f"\n{'query':<30} {'SQL':>10} {'snapshot':>10}")
+            for name, sql, vectorized in queries:
+                print(
+                    f"{name:<30} {timed(sql, args.repeat):7.3f} ms "
+                    f"{timed(vectorized, args.repeat):7.3f} ms"
+                )
+
+            print("\nrefresh")
+            print(f"  {'first load':<36} {first_load:8.1f} ms")
+            unchanged = timed(lambda: snapshot.refresh(session), args.repeat)
+            print(f"  {'unchanged':<36} {unchanged:8.3f} ms")
+            updated = write_and_refresh(
+                snapshot,
+                update(User)
+                .where(User.id.in_(range(1, args.rows, args.rows // 10)))
+                .values(age=User.age + 1, version=User.version + 1),
+            )
+            print(f"  {'after 10 scattered updates':<36} {updated:8.1f} ms")
+            appended = write_and_refresh(
+                snapshot,
+                insert(User).values(
+                    first_name="New",
+                    last_name="User",
+                    company_name="Company",
+                    city="City1",
+                    state="S1",
+                    zip=10001,
+                    email="new@example.com",
+                    web="http://www.example.com",
+                    age=30,
+                ),
+            )
+            print(f"  {'after 1 insert':<36} {appended:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measure cold start of the Flask app: module import plus config_app().
+
+Each run is a fresh interpreter, so the numbers include import time the way
+a new worker process sees it.
+
+Usage: DATABASE_URL=sqlite:///users.db python benchmarks/bench_startup.py [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.config_app()
+print(json.dumps({"import": imported - started, "total": time.perf_counter() - started}))
+"""
+
+
+def run(mode, runs):
+    env = {**os.environ, "DB_INIT": mode, "RATELIMIT_STORAGE_URI": "memory://"}
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=APP_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'DB_INIT':>8} {'import ms':>10} {'total ms':>10}  (median of {args.runs})")
+    for mode in ("auto", "skip"):
+        samples = run(mode, args.runs)
+        imported = statistics.median(sample["import"] for sample in samples) * 1000
+        total = statistics.median(sample["total"] for sample in samples) * 1000
+        print(f"{mode:>8} {imported:>10.1f} {total:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
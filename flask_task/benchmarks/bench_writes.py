@@ -0,0 +1,170 @@
+"""Compare load-then-write ORM handlers with single-statement RETURNING writes.
+
+Each case runs the write plus its rollup and change-counter updates and
+commits, like the PUT/PATCH/DELETE handlers do. Statement counts are the
+round trips per write; they matter most on a networked database, so pass
+--database-url to run against PostgreSQL. Use a scratch database: all
+tables are dropped and recreated.
+
+Usage: python benchmarks/bench_writes.py [--rows 20000] [--writes 2000]
+       [--database-url postgresql://...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+from db_util import db  # noqa: E402
+from etags import bump_users_version  # noqa: E402
+from models import User  # noqa: E402
+from serializers import serialize_user  # noqa: E402
+from user_batch import to_values  # noqa: E402
+from user_stats import apply_changes, stat_key  # noqa: E402
+from user_writes import delete_user_row, update_user_row  # noqa: E402
+
+PATCH = {"email": "changed@example.com"}
+PUT = {
+    "first_name": "First",
+    "last_name": "Last",
+    "company_name": "Company",
+    "city": "Moved",
+    "state": "MV",
+    "zip": 12345,
+    "email": "moved@example.com",
+    "web": "http://www.example.com",
+    "age": 42,
+}
+
+
+def orm_update(session, user_id, data, full):
+    # What the handlers did before user_writes.py
+    user = session.execute(db.select(User).filter_by(id=user_id)).scalar_one()
+    before = stat_key(user)
+    for field, value in to_values(data, full).items():
+        setattr(user, field, value)
+    after = stat_key(user)
+    if before != after:
+        apply_changes([(before, -1), (after, 1)], session=session)
+    bump_users_version(conn=session)
+    session.commit()
+    return serialize_user(user)
+
+
+def orm_delete(session, user_id):
+    user = session.execute(db.select(User).filter_by(id=user_id)).scalar_one()
+    apply_changes([(stat_key(user), -1)], session=session)
+    bump_users_version(conn=session)
+    session.delete(user)
+    session.commit()
+
+
+def returning_update(session, user_id, data, full):
+    result = update_user_row(session, user_id, to_values(data, full))
+    session.commit()
+    return result
+
+
+def returning_delete(session, user_id):
+    delete_user_row(session, user_id)
+    session.commit()
+
+
+CASES = [
+    (
+        "PATCH email",
+        lambda s, i: orm_update(s, i, PATCH, False),
+        lambda s, i: returning_update(s, i, PATCH, False),
+    ),
+    (
+        "PUT (moves city/state/age)",
+        lambda s, i: orm_update(s, i, PUT, True),
+        lambda s, i: returning_update(s, i, PUT, True),
+    ),
+    ("DELETE", orm_delete, returning_delete),
+]
+
+
+def make_app(url, rows):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    db.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "first_name": f"First{i}",
+                    "last_name": f"Last{i}",
+                    "company_name": f"Company {i % 997}",
+                    "city": f"City{i % 1500}",
+                    "state": f"S{i % 50}",
+                    "zip": 10000 + i % 89999,
+                    "email": f"user{i}@example.com",
+                    "web": f"http://www.company{i % 997}.com",
+                    "age": 18 + i % 80,
+                }
+                for i in range(rows)
+            ],
+        )
+        db.session.commit()
+    return app
+
+
+def measure(app, fn, ids):
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            started = time.perf_counter()
+            for user_id in ids:
+                fn(db.session, user_id)
+            elapsed = time.perf_counter() - started
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+            db.session.remove()
+    return elapsed / len(ids) * 1000, statements / len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--database-url", help="scratch database; it is wiped")
+    args = parser.parse_args()
+    if args.writes * len(CASES) * 2 > args.rows:
+        parser.error("--rows must be at least 6 x --writes")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = make_app(url, args.rows)
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        # Each case writes to its own slice of ids, so deletes never miss
+        ids = iter(range(1, args.rows + 1))
+
+        print(f"{args.writes} writes per case on {dialect}")
+        print(f"{'case':<28} {'load+write':>18} {'RETURNING':>18}")
+        for name, legacy, current in CASES:
+            cells = []
+            for fn in (legacy, current):
+                batch = [next(ids) for _ in range(args.writes)]
+                ms, statements = measure(app, fn, batch)
+                cells.append(f"{ms:6.3f} ms {statements:4.1f} st")
+            print(f"{name:<28} {cells[0]:>18} {cells[1]:>18}")
+
+
+if __name__ == "__main__":
+    main()
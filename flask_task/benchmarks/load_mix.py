@@ -0,0 +1,401 @@
+"""Replay a mix of user API traffic against the Flask and Django apps.
+
+Seeds the same generated users into a fresh SQLite database per app, serves
+flask_task (main.config_app) and django_rest_api (mock_app.wsgi) on the
+thread-pooled WSGI server of load_test.py, and drives each with concurrent
+keep-alive clients sending a weighted mix of list, search, sort, get, create,
+update and delete requests. Prints requests/sec and p50/p95/p99 latency per
+operation and writes them as JSON, with the git commit, so runs can be
+compared across commits.
+
+Usage:
+    python benchmarks/load_mix.py [--apps flask django] [--users 10000] \
+        [--mix list=30,search=15,sort=15,get=25,create=5,update=7,delete=3] \
+        [--concurrency 16] [--duration 20] [--warmup 3] [--threads 8] \
+        [--output results.json] [--compare baseline.json]
+
+Deletes remove users created during the run; until one exists, a delete is
+sent as a create instead. Rate limiting is off in the Flask app; the Django
+project runs with its own settings.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from load_test import Client, free_port, serve_wsgi, wait_for_server
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DJANGO_DIR = os.path.join(os.path.dirname(APP_DIR), "django_rest_api")
+
+OPERATIONS = ("list", "search", "sort", "get", "create", "update", "delete")
+DEFAULT_MIX = "list=30,search=15,sort=15,get=25,create=5,update=7,delete=3"
+SORTS = ("age", "-age", "city", "-zip", "last_name")
+PAGE_SIZE = 20
+
+FIRST_NAMES = (
+    "James Mary Robert Patricia John Jennifer Michael Linda David Elizabeth "
+    "William Barbara Richard Susan Joseph Jessica Thomas Sarah Charles Karen"
+).split()
+LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez "
+    "Hernandez Lopez Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin"
+).split()
+CITIES = (
+    "New York, Los Angeles, Chicago, Houston, Phoenix, Philadelphia, "
+    "San Antonio, San Diego, Dallas, Austin, Newark, Trenton"
+).split(", ")
+STATES = ("NY", "CA", "IL", "TX", "AZ", "PA", "NJ", "FL", "OH", "WA")
+
+
+def parse_mix(value):
+    # "list=30,get=25" -> {"list": 30, "get": 25}
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def make_user(rng, email):
+    return {
+        "first_name": rng.choice(FIRST_NAMES),
+        "last_name": rng.choice(LAST_NAMES),
+        "company_name": f"Company {rng.randint(1, 500)}",
+        "city": rng.choice(CITIES),
+        "state": rng.choice(STATES),
+        "zip": rng.randint(10000, 99999),
+        "email": email,
+        "web": f"http://www.company{rng.randint(1, 500)}.com",
+        "age": rng.randint(18, 90),
+    }
+
+
+def seed(directory, count):
+    # The same users, in the same order (ids 1..count), for every app
+    rng = random.Random(42)
+    users = [make_user(rng, f"user{i}@example.com") for i in range(count)]
+    path = os.path.join(directory, "users.jsonl")
+    with open(path, "w") as file:
+        file.writelines(json.dumps(user) + "\n" for user in users)
+    return path, users
+
+
+def seed_flask(directory, users_file, users, log):
+    database = os.path.join(directory, "flask.db")
+    subprocess.run(
+        [sys.executable, "populate_db.py", users_file]
+        + ["--database-url", f"sqlite:///{database}"],
+        cwd=APP_DIR,
+        stdout=log,
+        stderr=log,
+        check=True,
+    )
+    return {"DATABASE_URL": f"sqlite:///{database}"}
+
+
+def seed_django(directory, users_file, users, log):
+    database = os.path.join(directory, "django.db")
+    env = {**os.environ, "DJANGO_DB_PATH": database}
+    subprocess.run(
+        [sys.executable, "manage.py", "migrate", "--verbosity", "0"],
+        cwd=DJANGO_DIR,
+        env=env,
+        stdout=log,
+        stderr=log,
+        check=True,
+    )
+    columns = list(users[0])
+    with sqlite3.connect(database) as conn:
+        conn.executemany(
+            f"INSERT INTO api_user ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            [tuple(user[column] for column in columns) for user in users],
+        )
+    return {"DJANGO_DB_PATH": database}
+
+
+# name: (seeder, trailing slash of the URLs)
+APPS = {"flask": (seed_flask, ""), "django": (seed_django, "/")}
+
+
+def serve(app, port, threads):
+    # Runs in the server subprocess
+    if app == "flask":
+        sys.path.insert(0, APP_DIR)
+        from main import config_app
+
+        serve_wsgi(port, threads, config_app())
+    else:
+        sys.path.insert(0, DJANGO_DIR)
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mock_app.settings")
+        from django.core.wsgi import get_wsgi_application
+
+        serve_wsgi(port, threads, get_wsgi_application())
+
+
+def start_server(app, port, threads, env, directory, log):
+    # cwd is the scratch directory, so app.log and the like stay out of the repo
+    command = [sys.executable, os.path.abspath(__file__), "--serve", app, str(port)]
+    command += ["--threads", str(threads)]
+    env = {
+        **os.environ,
+        **env,
+        "RATELIMIT_ENABLED": "0",
+        "RATELIMIT_STORAGE_URI": "memory://",
+    }
+    process = subprocess.Popen(command, cwd=directory, env=env, stdout=log, stderr=log)
+    return wait_for_server(process, port, app)
+
+
+class Traffic:
+    # Builds the requests of one app; shared by all clients of a run
+    def __init__(self, slash, users, mix, seed):
+        self.slash = slash
+        self.users = users
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.rng = random.Random(seed)
+        self.created = []
+        self.serial = 0
+
+    def collection(self, query=None):
+        path = f"/api/v1/users{self.slash}"
+        return f"{path}?{query}" if query else path
+
+    def item(self, user_id):
+        return f"/api/v1/users/{user_id}{self.slash}"
+
+    def next_request(self):
+        # (operation, method, path, body)
+        rng = self.rng
+        operation = rng.choices(self.operations, self.weights)[0]
+        if operation == "delete" and not self.created:
+            operation = "create"
+        pages = max(1, min(100, self.users // PAGE_SIZE))
+
+        if operation == "list":
+            query = f"page={rng.randint(1, pages)}&limit={PAGE_SIZE}"
+            return operation, "GET", self.collection(query), None
+        if operation == "search":
+            query = f"search={rng.choice(FIRST_NAMES)}&limit={PAGE_SIZE}"
+            return operation, "GET", self.collection(query), None
+        if operation == "sort":
+            query = f"sort={rng.choice(SORTS)}&page={rng.randint(1, pages)}"
+            query += f"&limit={PAGE_SIZE}"
+            return operation, "GET", self.collection(query), None
+        if operation == "get":
+            return operation, "GET", self.item(rng.randint(1, self.users)), None
+        if operation == "create":
+            self.serial += 1
+            user = make_user(rng, f"load{self.serial}.{time.time_ns()}@example.com")
+            return operation, "POST", self.collection(), json.dumps(user)
+        if operation == "update":
+            body = json.dumps({"age": rng.randint(18, 90)})
+            return operation, "PATCH", self.item(rng.randint(1, self.users)), body
+        user_id = self.created.pop(rng.randrange(len(self.created)))
+        return operation, "DELETE", self.item(user_id), None
+
+    def record(self, operation, status, body):
+        if operation == "create" and status == 201:
+            data = json.loads(body)
+            self.created.append(data.get("data", data)["id"])
+
+
+async def run_mix(port, traffic, concurrency, warmup, duration):
+    samples = {operation: [] for operation in OPERATIONS}
+    errors = dict.fromkeys(OPERATIONS, 0)
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def worker():
+        client = Client("127.0.0.1", port)
+        while time.perf_counter() < deadline:
+            operation, method, path, body = traffic.next_request()
+            start = time.perf_counter()
+            try:
+                status, data = await client.request(
+                    path, method, body.encode() if body else None
+                )
+                traffic.record(operation, status, data)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status = None
+                await client.close()
+            if start < measure_from:
+                continue
+            if status is None or status >= 400:
+                errors[operation] += 1
+            else:
+                samples[operation].append(time.perf_counter() - start)
+        await client.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+
+    results = {
+        operation: summarize(samples[operation], errors[operation], elapsed)
+        for operation in OPERATIONS
+        if samples[operation] or errors[operation]
+    }
+    everything = [latency for latencies in samples.values() for latency in latencies]
+    results["all"] = summarize(everything, sum(errors.values()), elapsed)
+    return results
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        # Nearest-rank, in milliseconds
+        if not latencies:
+            return None
+        rank = max(math.ceil(q * len(latencies)), 1)
+        return round(latencies[rank - 1] * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def print_results(app, results):
+    print(f"\n{app}")
+    print(
+        f"{'operation':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'errors':>7}"
+    )
+    for operation, row in results.items():
+        cells = [
+            f"{row[key]:.2f}" if row[key] is not None else "-"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        ]
+        print(
+            f"{operation:<10} {row['rps']:>9.1f} {cells[0]:>9} {cells[1]:>9} "
+            f"{cells[2]:>9} {row['errors']:>7}"
+        )
+
+
+def print_comparison(baseline, report):
+    # Relative change of throughput and p95 per operation; + is more req/s,
+    # - on p95 is faster
+    print(f"\nchange vs {baseline.get('commit') or 'baseline'}")
+    print(f"{'app':<8} {'operation':<10} {'req/s':>9} {'p95':>9}")
+    for app, results in report["results"].items():
+        for operation, row in results.items():
+            before = baseline.get("results", {}).get(app, {}).get(operation)
+            if not before:
+                continue
+            cells = []
+            for key in ("rps", "p95_ms"):
+                if before[key] and row[key] is not None:
+                    cells.append(f"{(row[key] / before[key] - 1) * 100:+.1f}%")
+                else:
+                    cells.append("-")
+            print(f"{app:<8} {operation:<10} {cells[0]:>9} {cells[1]:>9}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=APP_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--apps", nargs="+", choices=tuple(APPS), default=list(APPS))
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--threads", type=int, default=8, help="server threads")
+    parser.add_argument("--seed", type=int, default=1, help="traffic random seed")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--serve", nargs=2, metavar=("APP", "PORT"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], int(args.serve[1]), args.threads)
+        return
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {
+            "users": args.users,
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "threads": args.threads,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        users_file, users = seed(directory, args.users)
+        for app in args.apps:
+            seeder, slash = APPS[app]
+            log_path = os.path.join(directory, f"{app}.log")
+            with open(log_path, "w") as log:
+                env = seeder(directory, users_file, users, log)
+                port = free_port()
+                try:
+                    process = start_server(app, port, args.threads, env, directory, log)
+                except SystemExit:
+                    with open(log_path) as output:
+                        sys.stderr.write(output.read()[-4000:])
+                    raise
+                try:
+                    traffic = Traffic(slash, args.users, args.mix, args.seed)
+                    results = asyncio.run(
+                        run_mix(
+                            port, traffic, args.concurrency, args.warmup, args.duration
+                        )
+                    )
+                finally:
+                    process.terminate()
+                    process.wait()
+            report["results"][app] = results
+            print_results(app, results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nresults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            print_comparison(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Concurrency sweep against the user API: throughput and latency per level.
+
+Starts the WSGI app (main.py, on a fixed pool of worker threads, like a sync
+gunicorn deployment) and/or the ASGI app (asgi_app.py under uvicorn), or
+targets an already running server with --url, then drives each with an
+increasing number of concurrent keep-alive clients.
+
+Usage:
+    DATABASE_URL=sqlite:///users.db python benchmarks/load_test.py \
+        [--target wsgi asgi] [--concurrency 1 8 32 128] [--duration 10] \
+        [--threads 8] [--path /api/v1/users?limit=20] [--url http://host:port]
+
+Rate limiting is disabled in the servers started here (RATELIMIT_ENABLED=0).
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_wsgi(port, threads, app):
+    # Requests are handled by at most `threads` threads at once; further
+    # connections queue in the listen backlog, as with sync workers
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class PooledServer(BaseWSGIServer):
+        pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    PooledServer("127.0.0.1", port, app, handler=KeepAliveHandler).serve_forever()
+
+
+def start_server(target, port, threads):
+    env = {**os.environ, "RATELIMIT_ENABLED": "0"}
+    if target == "wsgi":
+        command = [sys.executable, os.path.abspath(__file__), "--serve-wsgi"]
+        command += [str(port), "--threads", str(threads)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi_app:app"]
+        command += ["--port", str(port), "--log-level", "warning", "--no-access-log"]
+    return wait_for_server(
+        subprocess.Popen(command, cwd=APP_DIR, env=env), port, target
+    )
+
+
+def wait_for_server(process, port, name):
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit(f"{name} server exited with {process.returncode}")
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"{name} server did not start")
+
+
+class Client:
+    # Minimal HTTP/1.1 keep-alive client; reconnects when the server closes
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, path, method="GET", body=None):
+        # Returns (status, body); body is sent as JSON when given
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+            head += f"Content-Length: {len(body)}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        headers = dict(
+            (name.strip().lower(), value.strip())
+            for name, _, value in (line.partition(":") for line in lines[1:] if line)
+        )
+        chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        data = b""
+        if "content-length" in headers:
+            data = await self.reader.readexactly(int(headers["content-length"]))
+        elif chunked:
+            data = await self.read_chunked()
+        if headers.get("connection", "").lower() == "close" or not (
+            "content-length" in headers or chunked
+        ):
+            await self.close()
+        return status, data
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            chunks.append(await self.reader.readexactly(size + 2))
+            if not size:
+                return b"".join(chunk[:-2] for chunk in chunks)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def run_level(host, port, path, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        client = Client(host, port)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = await client.request(path)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                await client.close()
+                continue
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        await client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000 if latencies else None,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+        "errors": errors,
+    }
+
+
+def sweep(name, url, args):
+    parts = urlsplit(url)
+    print(f"\n{name} ({url}{args.path})")
+    print(
+        f"{'concurrency':>12} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'errors':>8}"
+    )
+    for concurrency in args.concurrency:
+        result = asyncio.run(
+            run_level(parts.hostname, parts.port, args.path, concurrency, args.duration)
+        )
+        p50 = f"{result['p50']:.1f}" if result["p50"] is not None else "-"
+        p95 = f"{result['p95']:.1f}" if result["p95"] is not None else "-"
+        print(
+            f"{concurrency:>12} {result['rps']:>10.0f} {p50:>10} {p95:>10} "
+            f"{result['errors']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--target", nargs="+", choices=("wsgi", "asgi"), default=["wsgi", "asgi"]
+    )
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--path", default="/api/v1/users?limit=20")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads")
+    parser.add_argument(
+        "--serve-wsgi", type=int, metavar="PORT", help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.serve_wsgi:
+        from main import config_app
+
+        serve_wsgi(args.serve_wsgi, args.threads, config_app())
+        return
+
+    if args.url:
+        sweep(args.url, args.url, args)
+        return
+
+    for target in args.target:
+        port = free_port()
+        process = start_server(target, port, args.threads)
+        try:
+            label = f"wsgi, {args.threads} threads" if target == "wsgi" else "asgi"
+            sweep(label, f"http://127.0.0.1:{port}", args)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
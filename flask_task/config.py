@@ -0,0 +1,83 @@
+from compression import parse_levels
+from db_routing import replica_urls
+from db_pool import InstrumentedQueuePool, uses_queue_pool
+import os
+
+# Engine and pool settings; a variable that is not set keeps SQLAlchemy's
+# default (pool of 5 plus 10 overflow, 30s timeout, no recycle or pre-ping)
+ENGINE_OPTIONS = (
+    ("DB_POOL_SIZE", "pool_size", int),
+    ("DB_MAX_OVERFLOW", "max_overflow", int),
+    ("DB_POOL_TIMEOUT", "pool_timeout", int),
+    ("DB_POOL_RECYCLE", "pool_recycle", int),
+    ("DB_POOL_PRE_PING", "pool_pre_ping", lambda value: value != "0"),
+    ("DB_POOL_USE_LIFO", "pool_use_lifo", lambda value: value != "0"),
+    ("DB_QUERY_CACHE_SIZE", "query_cache_size", int),
+)
+
+
+def load_config(app):
+    # Settings shared by the WSGI (main.py) and ASGI (asgi_app.py) apps
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+    # Read replicas, comma-separated; empty sends everything to DATABASE_URL.
+    # Flask-SQLAlchemy creates one engine and pool per bind, with the same
+    # pool settings as the primary.
+    app.config["SQLALCHEMY_BINDS"] = {
+        key: {"url": url, **engine_options(url)}
+        for key, url in replica_urls(os.getenv("DATABASE_REPLICA_URLS", "")).items()
+    }
+    app.config["DB_REPLICA_STICKY_SECONDS"] = float(
+        os.getenv("DB_REPLICA_STICKY_SECONDS", 5)
+    )
+    # Prepared statements cached per connection by asyncpg (ASGI app only)
+    app.config["DB_STATEMENT_CACHE_SIZE"] = int(
+        os.getenv("DB_STATEMENT_CACHE_SIZE", 100)
+    )
+    app.config["JSON_PROVIDER"] = os.getenv("JSON_PROVIDER", "auto")
+    app.config["USER_BATCH_MAX_OPERATIONS"] = int(
+        os.getenv("USER_BATCH_MAX_OPERATIONS", 50000)
+    )
+    app.config["USER_BATCH_CHUNK_SIZE"] = int(os.getenv("USER_BATCH_CHUNK_SIZE", 1000))
+    app.config["USER_EXPORT_BATCH_SIZE"] = int(
+        os.getenv("USER_EXPORT_BATCH_SIZE", 1000)
+    )
+    app.config["USER_CACHE_BACKEND"] = os.getenv("USER_CACHE_BACKEND", "memory")
+    app.config["USER_CACHE_TTL"] = float(os.getenv("USER_CACHE_TTL", 30))
+    app.config["USER_CACHE_MAXSIZE"] = int(os.getenv("USER_CACHE_MAXSIZE", 10000))
+    app.config["USER_CACHE_PATH"] = os.getenv("USER_CACHE_PATH", "user_cache.db")
+    app.config["USER_MULTIGET_MAX_IDS"] = int(os.getenv("USER_MULTIGET_MAX_IDS", 5000))
+    app.config["USER_MULTIGET_CHUNK_SIZE"] = int(
+        os.getenv("USER_MULTIGET_CHUNK_SIZE", 500)
+    )
+    # Per-process columnar copy of users for /users/analytics (needs numpy)
+    app.config["USER_SNAPSHOT_ENABLED"] = os.getenv("USER_SNAPSHOT_ENABLED", "0") != "0"
+    app.config["USER_COUNT_CACHE_SIZE"] = int(os.getenv("USER_COUNT_CACHE_SIZE", 1000))
+    app.config["COMPRESSION_ENABLED"] = os.getenv("COMPRESSION_ENABLED", "1") != "0"
+    app.config["COMPRESSION_MIN_SIZE"] = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+    app.config["COMPRESSION_LEVELS"] = parse_levels(os.getenv("COMPRESSION_LEVELS", ""))
+    # Shared across worker processes so limits hold per host, not per worker
+    app.config["RATELIMIT_STORAGE_URI"] = os.getenv(
+        "RATELIMIT_STORAGE_URI", "sqlite:///ratelimit.db"
+    )
+    app.config["RATELIMIT_STRATEGY"] = os.getenv("RATELIMIT_STRATEGY", "fixed-window")
+    app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+    app.config["DB_INIT"] = os.getenv("DB_INIT", "auto")
+    app.config["SWAGGER_UI"] = os.getenv("SWAGGER_UI", "1") != "0"
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "1") != "0"
+    app.config["METRICS_SLOW_REQUEST_MS"] = float(
+        os.getenv("METRICS_SLOW_REQUEST_MS", 500)
+    )
+
+
+def engine_options(url):
+    options = {
+        option: cast(os.environ[name])
+        for name, option, cast in ENGINE_OPTIONS
+        if os.getenv(name)
+    }
+    if url and uses_queue_pool(url):
+        options["poolclass"] = InstrumentedQueuePool
+    return options
@@ -0,0 +1,128 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    # Counters for one engine's pool in this process. Wait time is measured
+    # around the whole checkout, so it includes queueing for a free
+    # connection and opening a new one.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_close(self):
+        with self._lock:
+            self.closes += 1
+
+
+class PoolStatsMixin:
+    # Adds PoolStats to a QueuePool. The counters are carried over when the
+    # pool is recreated by engine.dispose().
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.stats.record_checkout(time.perf_counter() - start, timed_out=True)
+            logger.warning(
+                "Connection pool exhausted: %s checked out, timed out after %.2fs",
+                self.checkedout(),
+                time.perf_counter() - start,
+            )
+            raise
+        self.stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+    def _create_connection(self):
+        self.stats.record_connect()
+        return super()._create_connection()
+
+    def _close_connection(self, connection, *args, **kwargs):
+        self.stats.record_close()
+        return super()._close_connection(connection, *args, **kwargs)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(PoolStatsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(PoolStatsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def uses_queue_pool(url):
+    # In-memory SQLite gets a StaticPool from Flask-SQLAlchemy; every other
+    # database defaults to a QueuePool
+    url = make_url(url)
+    return not (
+        url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+    )
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    data = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        data.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                # QueuePool.overflow() is negative until the pool is full
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+                "timeout": pool.timeout(),
+            }
+        )
+
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        data.update(
+            {
+                "checkouts": stats.checkouts,
+                "timeouts": stats.timeouts,
+                "connects": stats.connects,
+                "closes": stats.closes,
+                "wait_ms_total": round(stats.wait_total * 1000, 3),
+                "wait_ms_max": round(stats.wait_max * 1000, 3),
+                "wait_ms_avg": (
+                    round(stats.wait_total * 1000 / stats.checkouts, 3)
+                    if stats.checkouts
+                    else None
+                ),
+            }
+        )
+    return data
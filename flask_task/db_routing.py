@@ -0,0 +1,111 @@
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+import math
+import random
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Read/write splitting. Requests that only read (GET/HEAD, or views marked
+# @read_only) run their queries on one of the DATABASE_REPLICA_URLS; writes,
+# flushes and every other request use the primary. A client that wrote gets
+# a cookie keeping its reads on the primary for DB_REPLICA_STICKY_SECONDS,
+# so replication lag never hides its own writes from it.
+
+READ_METHODS = {"GET", "HEAD"}
+STICKY_COOKIE = "db_primary_until"
+
+
+def replica_urls(value):
+    # "url1,url2" -> {"replica_0": "url1", "replica_1": "url2"}
+    urls = [url.strip() for url in value.split(",") if url.strip()]
+    return {f"replica_{i}": url for i, url in enumerate(urls)}
+
+
+def read_only(view):
+    # Lets a POST view that only reads (e.g. /users/lookup) use a replica
+    view.read_only = True
+    return view
+
+
+def is_read_request(view, method):
+    return method in READ_METHODS or getattr(view, "read_only", False)
+
+
+def pinned_to_primary(cookies):
+    try:
+        return float(cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pick_replica(replicas, view, method, cookies):
+    # Replica key for this request, or None to use the primary
+    if replicas and is_read_request(view, method) and not pinned_to_primary(cookies):
+        return random.choice(replicas)
+    return None
+
+
+def user_cache_modes(replica, cookies):
+    # (look up, fill) for the per-id user cache. A client pinned to the
+    # primary must see its own write, which a cached copy can predate, and a
+    # replica read may lag, so it is not cached. List pages need neither:
+    # they are keyed by the users version read from the same database.
+    return not pinned_to_primary(cookies), replica is None
+
+
+def pin_to_primary(response, window):
+    # After a successful write: the client's reads go to the primary until
+    # the cookie expires
+    response.set_cookie(
+        STICKY_COOKIE,
+        f"{time.time() + window:.3f}",
+        max_age=math.ceil(window),
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+class RoutingSession(Session):
+    # db.session: statements run on g.db_replica when a request picked one,
+    # except INSERT/UPDATE/DELETE and flushes, which always go to the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, "is_dml", False):
+            replica = g.get("db_replica") if has_app_context() else None
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def current_view():
+    return current_app.view_functions.get(request.endpoint)
+
+
+def choose_database():
+    g.db_replica = pick_replica(
+        current_app.extensions["db_replicas"],
+        current_view(),
+        request.method,
+        request.cookies,
+    )
+
+
+def pin_writer(response):
+    if (
+        not is_read_request(current_view(), request.method)
+        and response.status_code < 400
+    ):
+        pin_to_primary(response, current_app.config["DB_REPLICA_STICKY_SECONDS"])
+    return response
+
+
+def init_db_routing(app):
+    replicas = sorted(app.config["SQLALCHEMY_BINDS"])
+    app.extensions["db_replicas"] = replicas
+    if not replicas:
+        return
+    app.before_request(choose_database)
+    if app.config["DB_REPLICA_STICKY_SECONDS"] > 0:
+        app.after_request(pin_writer)
+    logger.info("Routing reads to %d replica(s)", len(replicas))
@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+import os
+import tempfile
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from models import User
+from db_util import db
+from populate_db import load_incomplete, populate_db
+from schema import upgrade_schema
+from search_index import init_search_index
+from user_stats import rebuild_stats, stats_missing
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key for pg_advisory_lock
+ADVISORY_LOCK_KEY = 7305182
+LOCK_FILE = os.path.join(tempfile.gettempdir(), "flask_task_db_init.lock")
+
+
+@contextmanager
+def startup_lock(engine):
+    # Serializes database setup between processes starting at the same time:
+    # a session advisory lock on PostgreSQL (all hosts), a file lock
+    # otherwise (processes on this host)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(
+                text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+            )
+            try:
+                yield
+            finally:
+                conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY}
+                )
+                conn.commit()
+        return
+
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - not available on Windows
+        yield
+        return
+    with open(LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def setup_database(app, seed_file):
+    # Idempotent: create missing tables and columns and the search index, seed
+    # an empty users table from seed_file (or finish a seed that was cut
+    # short) and build the statistics rollup
+    started = time.perf_counter()
+    with startup_lock(db.engine):
+        db.create_all()
+        with db.engine.begin() as conn:
+            upgrade_schema(conn)
+        init_search_index(app, db.engine)
+        empty = not db.session.execute(db.select(User.id).limit(1)).first()
+        if empty or load_incomplete(db.session, seed_file):
+            populate_db(seed_file)
+            rebuild_stats()
+        elif stats_missing():
+            rebuild_stats()
+    db.session.remove()
+    logger.info("Database setup took %.1fms", (time.perf_counter() - started) * 1000)
+
+
+@click.command("init-db")
+@click.option("--seed-file", default="users.json", show_default=True)
+@with_appcontext
+def init_db_command(seed_file):
+    """Create the schema, seed an empty database and build the rollup."""
+    setup_database(current_app, seed_file)
+    click.echo("Database initialized.")
@@ -1,9 +1,39 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, update
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import DeclarativeBase
+from db_routing import RoutingSession
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
+
+
+def increment_counter(model, key, delta, conn=None):
+    # Add delta to model.count for the row identified by key, creating the row
+    # if missing. Runs on conn (a Connection or Session) when given, otherwise in
+    # the current db.session.
+    executor = conn if conn is not None else db.session
+    bind = executor if isinstance(executor, Connection) else executor.get_bind()
+    dialect = bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        stmt = dialect_insert(model).values(**key, count=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key), set_={"count": model.count + delta}
+        )
+        executor.execute(stmt)
+        return
+
+    result = executor.execute(
+        update(model).filter_by(**key).values(count=model.count + delta)
+    )
+    if result.rowcount == 0:
+        executor.execute(insert(model).values(**key, count=delta))
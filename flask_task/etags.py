@@ -0,0 +1,62 @@
+from hashlib import blake2b
+from flask import make_response, request
+from sqlalchemy import select
+from models import ChangeCounter
+from db_util import db, increment_counter
+
+USERS_COUNTER = "users"
+USERS_VERSION_QUERY = select(ChangeCounter.count).where(
+    ChangeCounter.name == USERS_COUNTER
+)
+
+
+def bump_users_version(conn=None):
+    # Call in the same transaction as any write to the users table
+    increment_counter(ChangeCounter, {"name": USERS_COUNTER}, 1, conn=conn)
+
+
+def users_version():
+    return db.session.execute(USERS_VERSION_QUERY).scalar() or 0
+
+
+def user_etag(user_id, version, fields=None):
+    return sparse_etag(f"u{user_id}.{version}", fields)
+
+
+def sparse_etag(etag, fields=None):
+    # A sparse representation (fields=) gets its own ETag
+    if fields is None:
+        return etag
+    digest = blake2b(",".join(fields).encode(), digest_size=4).hexdigest()
+    return f"{etag}.{digest}"
+
+
+def list_etag(params, version):
+    # The table counter changes on every write; the digest keeps ETags of
+    # different queries apart so a client cannot reuse one for another
+    normalized = "&".join(
+        f"{name}={value.strip()}" for name, value in sorted(params.items(multi=True))
+    )
+    digest = blake2b(normalized.encode(), digest_size=8).hexdigest()
+    return f"l{version}.{digest}"
+
+
+def not_modified(etag):
+    # A 304 for the current request when the client already holds etag
+    if etag and request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def etag_matches(if_match, etag):
+    # If-Match against a user ETag. It names the row version, which is the
+    # same whatever encoding the body was sent in, so the W/ that compression
+    # adds (compression.weaken_etag) is ignored
+    return if_match.contains_weak(etag)
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,106 @@
+import base64
+import json
+from sqlalchemy import and_, or_, tuple_
+from models import SORTABLE_FIELDS, User
+
+
+# Integers the database can bind
+INT64 = range(-(2**63), 2**63)
+
+
+class KeysetError(ValueError):
+    pass
+
+
+def sort_column(sort):
+    # Split "-field" into (column, descending); only indexed fields are allowed
+    descending = sort.startswith("-")
+    field = sort[1:] if descending else sort
+    if field not in SORTABLE_FIELDS:
+        raise KeysetError(
+            f"Invalid sort field: {field}. "
+            f"Expected one of: {', '.join(SORTABLE_FIELDS)} (prefix '-' to reverse)"
+        )
+    return getattr(User, field), descending
+
+
+def sort_ordering(sort):
+    # ORDER BY (field, id), both in the sort direction, which walks the
+    # (field, id) index forwards or backwards. NULLS LAST is only added for
+    # nullable columns, as it keeps PostgreSQL from using the index backwards.
+    column, descending = sort_column(sort)
+    if column.key == "id":
+        return [User.id.desc() if descending else User.id.asc()]
+    key = column.desc() if descending else column.asc()
+    if column.nullable:
+        key = key.nulls_last()
+    return [key, User.id.desc() if descending else User.id.asc()]
+
+
+def encode_cursor(sort, user):
+    column, _ = sort_column(sort)
+    payload = {"s": sort, "v": getattr(user, column.key), "id": user.id}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, sort):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        value, last_id = payload["v"], int(payload["id"])
+        cursor_sort = payload["s"]
+    except (ValueError, KeyError, TypeError):
+        raise KeysetError("Malformed cursor")
+
+    if cursor_sort != sort:
+        raise KeysetError("Cursor was issued for a different sort order")
+    column, _ = sort_column(sort)
+    if not valid_cursor_value(column, value) or last_id not in INT64:
+        raise KeysetError("Malformed cursor")
+    return value, last_id
+
+
+def valid_cursor_value(column, value):
+    # A forged value of the wrong type (a list, an object, a string for an
+    # integer column) or an integer past 64 bits would only fail once the
+    # database compares it
+    if value is None:
+        return column.nullable
+    if isinstance(value, bool) or not isinstance(value, column.type.python_type):
+        return False
+    return not isinstance(value, int) or value in INT64
+
+
+def apply_keyset(query, sort, token=None):
+    # Order by (sort key, id) and seek past the last row seen, so every page
+    # is an index range scan instead of OFFSET + COUNT(*)
+    column, descending = sort_column(sort)
+    ordering = sort_ordering(sort)
+
+    if token:
+        value, last_id = decode_cursor(token, sort)
+        after_id = User.id < last_id if descending else User.id > last_id
+        if column.key == "id":
+            query = query.filter(after_id)
+        elif not column.nullable:
+            # Row-value comparison: an index range condition on (field, id)
+            position = tuple_(column, User.id)
+            query = query.filter(
+                position < (value, last_id)
+                if descending
+                else position > (value, last_id)
+            )
+        elif value is None:
+            query = query.filter(and_(column.is_(None), after_id))
+        else:
+            after_value = column < value if descending else column > value
+            query = query.filter(
+                or_(
+                    after_value,
+                    and_(column == value, after_id),
+                    column.is_(None),
+                )
+            )
+
+    return query.order_by(*ordering)
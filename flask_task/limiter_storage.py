@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+import time
+from limits.storage import MovingWindowSupport, Storage
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    # Rate limit storage shared by every worker process on the host, backed by
+    # a local SQLite file in WAL mode. Each fixed-window hit is a single UPSERT,
+    # so the check-and-increment is atomic across processes without a lock
+    # server. Registered for "sqlite:///<path>" storage URIs.
+    STORAGE_SCHEME = ["sqlite"]
+    PURGE_EVERY = 10000
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = os.path.abspath(uri.split(":///", 1)[1]) if uri else "ratelimit.db"
+        self.timeout = float(options.get("timeout", 5))
+        self._local = threading.local()
+        self._hits = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS events (key TEXT NOT NULL, ts REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_events_key_ts ON events (key, ts)")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (gunicorn --preload)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        conn = self._connection()
+        # An expired window restarts at amount; elastic expiry pushes the
+        # window end forward on every hit
+        count = conn.execute(
+            "INSERT INTO counters (key, count, expiry) VALUES (?1, ?2, ?3) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "count = CASE WHEN expiry <= ?4 THEN ?2 ELSE count + ?2 END, "
+            "expiry = CASE WHEN expiry <= ?4 OR ?5 THEN ?3 ELSE expiry END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, bool(elastic_expiry)),
+        ).fetchone()[0]
+
+        self._hits += 1
+        if self._hits % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM counters WHERE expiry <= ?", (now,))
+        return count
+
+    def get(self, key):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT count FROM counters WHERE key = ? AND expiry > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = (
+            self._connection()
+            .execute("SELECT expiry FROM counters WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        conn = self._connection()
+        cleared = conn.execute("DELETE FROM counters").rowcount
+        conn.execute("DELETE FROM events")
+        return cleared
+
+    def clear(self, key):
+        conn = self._connection()
+        conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+        conn.execute("DELETE FROM events WHERE key = ?", (key,))
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        # Moving window: count and insert under one write transaction so
+        # concurrent workers cannot both take the last slot
+        if amount > limit:
+            return False
+
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM events WHERE key = ? AND ts <= ?", (key, now - expiry)
+            )
+            acquired = conn.execute(
+                "SELECT COUNT(*) FROM events WHERE key = ?", (key,)
+            ).fetchone()[0]
+            if acquired + amount > limit:
+                conn.execute("ROLLBACK")
+                return False
+            conn.executemany(
+                "INSERT INTO events (key, ts) VALUES (?, ?)", [(key, now)] * amount
+            )
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        start, acquired = (
+            self._connection()
+            .execute(
+                "SELECT MIN(ts), COUNT(*) FROM events WHERE key = ? AND ts > ?",
+                (key, now - expiry),
+            )
+            .fetchone()
+        )
+        return (start if start is not None else now), acquired
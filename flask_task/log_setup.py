@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; fields passed with extra= are included
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Runs in the logging thread before a record is queued, so dropped
+    # records cost neither formatting nor I/O.
+    # - Records below WARNING are kept with the probability configured for
+    #   their logger (the longest matching dotted prefix wins).
+    # - Each message template (logger, level, format string) is capped at
+    #   rate_limit records per second; the number of suppressed records is
+    #   attached to the next one that gets through.
+    def __init__(self, sample_rates=None, default_rate=1.0, rate_limit=0):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.default_rate = default_rate
+        self.rate_limit = rate_limit
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def sample_rate(self, name):
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return self.default_rate
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rate(record.name)
+            if rate < 1 and random.random() >= rate:
+                return False
+
+        if not self.rate_limit:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        second = int(time.monotonic())
+        with self._lock:
+            window, count, suppressed = self._windows.get(key, (second, 0, 0))
+            if window != second:
+                window, count = second, 0
+            if count >= self.rate_limit:
+                self._windows[key] = (window, count, suppressed + 1)
+                return False
+            self._windows[key] = (window, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    # Hands records to a background writer thread. Records are queued
+    # unformatted, so %-style arguments are only rendered by the writer;
+    # when the queue is full the record is dropped and counted instead of
+    # blocking the request.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_sample_rates(value):
+    # "routes=0.1,user_batch=0.5" -> {"routes": 0.1, "user_batch": 0.5}
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(log_file="app.log"):
+    # Route the root logger through a bounded queue to a writer thread.
+    # Settings come from LOG_LEVEL, LOG_FORMAT (json or text), LOG_FILE,
+    # LOG_QUEUE_SIZE, LOG_SAMPLE_RATE, LOG_SAMPLE_RATES and LOG_RATE_LIMIT.
+    root = logging.getLogger()
+    if any(isinstance(handler, AsyncQueueHandler) for handler in root.handlers):
+        return
+
+    if os.getenv("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    file_handler = logging.FileHandler(os.getenv("LOG_FILE", log_file))
+    file_handler.setFormatter(formatter)
+
+    handler = AsyncQueueHandler(queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", 10000))))
+    handler.addFilter(
+        SamplingFilter(
+            sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+            default_rate=float(os.getenv("LOG_SAMPLE_RATE", 1)),
+            rate_limit=int(os.getenv("LOG_RATE_LIMIT", 100)),
+        )
+    )
+    listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
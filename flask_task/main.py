@@ -1,52 +1,86 @@
+import time
+import click
 from flask import Flask, send_from_directory
-from flask_migrate import Migrate
-from models import User
+from compression import init_compression
+from config import load_config
 from routes import api_routes
 from db_util import db
-from populate_db import populate_db
+from db_routing import init_db_routing
+from db_setup import init_db_command, setup_database
 from rate_limiter import limiter
-import os
+from request_metrics import init_request_metrics
+from json_provider import init_json_provider
+from log_setup import configure_logging
+from query_plans import check_query_plans_command
+from user_cache import init_user_cache
+from user_counts import init_count_cache
+from user_snapshot import init_user_snapshot
+from user_stats import rebuild_stats_command
 import logging
 
-from flask_swagger_ui import get_swaggerui_blueprint
-
 
 path_to_file = "users.json"
 LOG_FILE = "app.log"
 
-logging.basicConfig(
-    level=logging.INFO,
-    filename=LOG_FILE,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+configure_logging(LOG_FILE)
 logger = logging.getLogger(__name__)
 
 API_URL = "/static/openapi.yaml"
 SWAGGER_URL = "/api/docs"
 
-swagger_blueprint = get_swaggerui_blueprint(
-    SWAGGER_URL,
-    API_URL,
-)
+
+def register_swagger_ui(app):
+    # Optional: imported only when enabled
+    try:
+        from flask_swagger_ui import get_swaggerui_blueprint
+    except ImportError:
+        logger.warning("flask-swagger-ui is not installed, %s disabled", SWAGGER_URL)
+        return
+    app.register_blueprint(get_swaggerui_blueprint(SWAGGER_URL, API_URL))
+
+
+def register_cli(app):
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(check_query_plans_command)
+    # Flask-Migrate pulls in Alembic; only the `flask db` commands need it, so
+    # it is loaded when the app is created by the flask CLI
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
 
 
 def config_app():
     # Initialize flask app with db, routes, rate-limits and migration configurations
+    started = time.perf_counter()
     app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
+    load_config(app)
+
+    init_json_provider(app, app.config["JSON_PROVIDER"])
+    init_user_cache(app)
+    init_count_cache(app)
+    init_user_snapshot(app)
 
     db.init_app(app)
+    init_db_routing(app)
     limiter.init_app(app)
 
     with app.app_context():
-        db.create_all()  # Creates table on first startup if table not exists
-        if not User.query.first():
-            populate_db(path_to_file)
-
-    Migrate(app, db)
-
+        if app.config["METRICS_ENABLED"]:
+            init_request_metrics(app, db.engines.values())
+        # "auto" creates/seeds the database on boot, one process at a time;
+        # with "skip" no query runs at startup and `flask init-db` does it once
+        if app.config["DB_INIT"] == "auto":
+            setup_database(app, path_to_file)
+    # after_request hooks run in reverse order, so compressing happens before
+    # the metrics hook measures the request
+    init_compression(app)
+
+    register_cli(app)
     app.register_blueprint(api_routes)
-    app.register_blueprint(swagger_blueprint)
+    if app.config["SWAGGER_UI"]:
+        register_swagger_ui(app)
 
     @app.route("/static/<path:filename>")
     def serve_openapi_spec(filename):
@@ -60,6 +94,15 @@ def config_app():
     def health_check():
         return {"message": "Health check successful"}
 
+    startup = time.perf_counter() - started
+    app.extensions["startup_seconds"] = startup
+    if "request_metrics" in app.extensions:
+        app.extensions["request_metrics"].set_gauge(
+            "app_startup_seconds", startup, "Time spent in config_app"
+        )
+    logger.info(
+        "App created in %.1fms (DB_INIT=%s)", startup * 1000, app.config["DB_INIT"]
+    )
     return app
 
 
@@ -1,6 +1,12 @@
 from db_util import db
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped, mapped_column
 
+# Fields GET /users can sort by. Each gets a (field, id) index, which serves
+# both directions of ORDER BY field, id and the keyset seek on (field, id).
+# The state, zip and age indexes also serve the filters of the same name.
+SORTABLE_FIELDS = ("id", "first_name", "last_name", "city", "state", "zip", "age")
+
 
 class User(db.Model):
     __tablename__ = "users"
@@ -15,6 +21,55 @@ class User(db.Model):
     email: Mapped[str]
     web: Mapped[str]
     age: Mapped[int]
+    # Bumped on every update; compared in the UPDATE's WHERE clause by the ORM.
+    # Together with the id it forms the ETag, so ids are never reused: SQLite
+    # only guarantees that for AUTOINCREMENT tables (sequences never reuse).
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = tuple(
+        Index(f"ix_users_{field}_id", field, "id")
+        for field in SORTABLE_FIELDS
+        if field != "id"
+    ) + (
+        # state=XX combined with an age range seeks straight to the matches
+        Index("ix_users_state_age", "state", "age"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class ChangeCounter(db.Model):
+    # Per-table write counter, bumped in the same transaction as each write
+    __tablename__ = "change_counters"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+
+class UserGroupCount(db.Model):
+    # Rollup of users per city / state, maintained by the write handlers
+    __tablename__ = "user_group_counts"
+
+    kind: Mapped[str] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+
+
+class LoadCheckpoint(db.Model):
+    # Rows committed so far per bulk-load source, so a failed load can resume
+    __tablename__ = "load_checkpoints"
+
+    source: Mapped[str] = mapped_column(primary_key=True)
+    rows_loaded: Mapped[int] = mapped_column(default=0)
+    completed: Mapped[bool] = mapped_column(default=False)
+
+
+class UserAgeCount(db.Model):
+    # Histogram of users per age, from which avg/min/max age are derived
+    __tablename__ = "user_age_counts"
+
+    age: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    count: Mapped[int] = mapped_column(default=0)
 
 
 #  {
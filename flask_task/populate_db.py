@@ -1,36 +1,282 @@
+import argparse
+import csv
 import json
+import os
+import sys
+import time
+from flask import Flask
+from sqlalchemy import delete, insert, select, update
 from db_util import db
-from models import User
+from etags import bump_users_version
+from models import LoadCheckpoint, User
+from schema import upgrade_schema
+from search_index import init_search_index
+from user_stats import rebuild_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
 path_to_file = "users.json"
 
+DEFAULT_BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 64 * 1024
+USER_FIELDS = (
+    "first_name",
+    "last_name",
+    "company_name",
+    "city",
+    "state",
+    "zip",
+    "email",
+    "web",
+    "age",
+)
+INT_FIELDS = {"zip", "age"}
 
-def populate_db(path_to_file):
+
+def iter_json_array(fp, chunk_size=READ_CHUNK_SIZE):
+    # Yield the elements of a top-level JSON array while reading the file in
+    # fixed-size chunks, so memory is bounded by one chunk plus one record
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    expect = "["
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            buffer, pos = fp.read(chunk_size), 0
+            eof = not buffer
+            continue
+
+        char = buffer[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array of user records")
+            expect, pos = "first", pos + 1
+        elif expect in ("first", "sep") and char == "]":
+            return
+        elif expect == "sep":
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' at offset {pos}")
+            expect, pos = "value", pos + 1
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # The record continues in the next chunk
+                more = fp.read(chunk_size)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            expect, pos = "sep", end
+
+
+def iter_jsonl(fp):
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(fp, fmt):
+    if fmt == "json":
+        return iter_json_array(fp)
+    if fmt == "jsonl":
+        return iter_jsonl(fp)
+    if fmt == "csv":
+        return csv.DictReader(fp)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return {"ndjson": "jsonl"}.get(extension, extension)
+
+
+def to_row(record):
+    row = {}
+    for field in USER_FIELDS:
+        value = record.get(field)
+        if value == "":
+            value = None
+        if field in INT_FIELDS and value is not None:
+            value = int(value)
+        row[field] = value
+
+    if row["first_name"] is None or row["email"] is None:
+        raise ValueError(f"Record missing first_name or email: {record}")
+    return row
+
+
+class LoadError(ValueError):
+    pass
+
+
+def load_users(engine, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, restart=False):
+    # Stream users from path into the users table with Core executemany
+    # inserts, committing each batch together with the checkpoint row.
+    # An interrupted load of the same file resumes after the records its
+    # committed batches covered; restart=True reads the file from the top,
+    # on top of the rows already loaded.
+    fmt = fmt or detect_format(path)
+    source = os.path.abspath(path)
+
+    with engine.begin() as conn:
+        checkpoint = conn.execute(
+            select(LoadCheckpoint).where(LoadCheckpoint.source == source)
+        ).first()
+        if checkpoint and not conn.execute(select(User.id).limit(1)).first():
+            # The rows it counted are gone, so the checkpoint no longer applies
+            restart = True
+        if checkpoint and checkpoint.completed and not restart:
+            raise LoadError(
+                f"{path} was already loaded; use --restart to load it again"
+            )
+        if checkpoint and restart:
+            conn.execute(delete(LoadCheckpoint).where(LoadCheckpoint.source == source))
+            checkpoint = None
+        if not checkpoint:
+            conn.execute(insert(LoadCheckpoint).values(source=source, rows_loaded=0))
+        skip = checkpoint.rows_loaded if checkpoint else 0
+
+    if skip:
+        logger.info("Resuming load of %s after %d rows", path, skip)
+
+    started = time.perf_counter()
+    loaded = 0
+    position = 0
+    batch = []
+
+    def flush():
+        nonlocal loaded
+        with engine.begin() as conn:
+            conn.execute(insert(User), batch)
+            bump_users_version(conn)
+            conn.execute(
+                update(LoadCheckpoint)
+                .where(LoadCheckpoint.source == source)
+                .values(rows_loaded=position)
+            )
+        loaded += len(batch)
+        batch.clear()
+
+        elapsed = time.perf_counter() - started
+        rate = loaded / elapsed if elapsed else 0.0
+        logger.info("Loaded %d rows from %s (%.0f rows/sec)", loaded, path, rate)
+
+    with open(path, "r", newline="" if fmt == "csv" else None) as fp:
+        for record in iter_records(fp, fmt):
+            position += 1
+            if position <= skip:
+                continue
+            batch.append(to_row(record))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(LoadCheckpoint)
+            .where(LoadCheckpoint.source == source)
+            .values(rows_loaded=position, completed=True)
+        )
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Finished loading %s: %d rows in %.2fs (%.0f rows/sec)",
+        path,
+        loaded,
+        elapsed,
+        loaded / elapsed if elapsed else 0.0,
+    )
+    return loaded
+
+
+def load_incomplete(conn, path):
+    # True when an earlier load of path stopped before the end of the file
+    checkpoint = conn.execute(
+        select(LoadCheckpoint.completed).where(
+            LoadCheckpoint.source == os.path.abspath(path)
+        )
+    ).first()
+    return checkpoint is not None and not checkpoint.completed
+
+
+def populate_db(path_to_file, batch_size=DEFAULT_BATCH_SIZE):
     try:
-        with open(path_to_file, "r") as fp:
-            user_list = json.load(fp)
-
-            for user in user_list:
-                new_user = User(
-                    first_name=user["first_name"],
-                    last_name=user.get("last_name"),
-                    company_name=user.get("company_name"),
-                    city=user.get("city"),
-                    state=user.get("state"),
-                    zip=user.get("zip"),
-                    email=user["email"],
-                    web=user.get("web"),
-                    age=user.get("age"),
-                )
-
-                db.session.add(new_user)
-                db.session.commit()
-
-            logging.info("All records from users.json added successfully to db")
+        db.session.commit()  # release the session's read transaction first
+        load_users(db.engine, path_to_file, batch_size=batch_size)
+        logger.info("All records from %s added successfully to db", path_to_file)
 
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        db.session.rollback()
+        logger.error("Failed to populate db from %s: %s", path_to_file, e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Bulk load users from a JSON, JSONL or CSV file."
+    )
+    parser.add_argument("path", nargs="?", default=path_to_file)
+    parser.add_argument("--format", choices=["json", "jsonl", "csv"], default=None)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    restart = parser.add_mutually_exclusive_group()
+    restart.add_argument(
+        "--resume",
+        dest="restart",
+        action="store_false",
+        default=False,
+        help="Skip the records committed by a previous, interrupted run (default)",
+    )
+    restart.add_argument(
+        "--restart",
+        action="store_true",
+        help="Load the whole file again, even if it was (partly) loaded before",
+    )
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error("Set DATABASE_URL or pass --database-url")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    # A bare app is enough to bind the models; no routes or seeding run here
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_url
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            upgrade_schema(conn)
+        init_search_index(app, db.engine)
+        try:
+            load_users(
+                db.engine,
+                args.path,
+                fmt=args.format,
+                batch_size=args.batch_size,
+                restart=args.restart,
+            )
+        except LoadError as e:
+            logger.error("%s", e)
+            return 1
+        except Exception as e:
+            logger.error("Load failed, rerun to continue: %s", e)
+            return 1
+        rebuild_stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
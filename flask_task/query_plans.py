@@ -0,0 +1,142 @@
+from types import SimpleNamespace
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from models import SORTABLE_FIELDS, User
+from db_util import db
+from keyset import apply_keyset, encode_cursor, sort_ordering
+from search_index import search_backend
+from serializers import USER_COLUMNS
+from user_queries import filtered_users
+
+# Sample cursor values per column type; only the plan matters, not the rows
+SAMPLE_VALUES = {int: 50, str: "M"}
+# Column each list filter constrains
+FILTER_COLUMNS = {"state": "state", "zip": "zip", "age_min": "age", "age_max": "age"}
+
+
+def explain(conn, query):
+    sql = str(
+        query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    )
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+        return [row[-1] for row in rows]
+    return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {sql}").all()]
+
+
+def sorted_by_index(conn, plan):
+    if conn.dialect.name == "sqlite":
+        return not any("TEMP B-TREE" in line for line in plan)
+    return not any("Sort" in line or "Seq Scan" in line for line in plan)
+
+
+def seeks_by_index(conn, plan):
+    if conn.dialect.name == "sqlite":
+        return any(line.startswith("SEARCH") for line in plan)
+    return any("Index Cond" in line for line in plan)
+
+
+def seeks_on(*columns):
+    # seeks_by_index, with all of columns in one index condition: a filter
+    # on state and age must not be answered by the index on state alone
+    def predicate(conn, plan):
+        if conn.dialect.name == "sqlite":
+            seeks = [line for line in plan if line.startswith("SEARCH")]
+        else:
+            seeks = [line for line in plan if "Index Cond" in line]
+        return any(
+            all(re.search(rf"\b{column}\b", line) for column in columns)
+            for line in seeks
+        )
+
+    return predicate
+
+
+def uses_search_index(conn, plan):
+    if conn.dialect.name == "sqlite":
+        return any("users_fts" in line for line in plan)
+    return any("_trgm" in line for line in plan)
+
+
+def plan_checks(backend):
+    # (description, query, predicate) for every supported list query shape
+    base = select(*USER_COLUMNS)
+    for field in SORTABLE_FIELDS:
+        column = getattr(User, field)
+        sample = SimpleNamespace(
+            **{"id": 100, field: SAMPLE_VALUES[column.type.python_type]}
+        )
+        for sort in (field, f"-{field}"):
+            yield (
+                f"sort={sort} page=3",
+                base.order_by(*sort_ordering(sort)).limit(5).offset(10),
+                sorted_by_index,
+            )
+            yield (
+                f"sort={sort} cursor",
+                apply_keyset(base, sort, encode_cursor(sort, sample)).limit(6),
+                lambda conn, plan: sorted_by_index(conn, plan)
+                and seeks_by_index(conn, plan),
+            )
+
+    for filters in (
+        {"state": "NJ"},
+        {"zip": "80"},
+        {"age_min": 30},
+        {"age_min": 30, "age_max": 40},
+        {"state": "NJ", "age_min": 30, "age_max": 40},
+    ):
+        yield (
+            "&".join(f"{name}={value}" for name, value in filters.items()),
+            filtered_users(filters, backend).limit(5),
+            seeks_on(*{FILTER_COLUMNS[name] for name in filters}),
+        )
+
+    if backend in ("fts5", "pg_trgm"):
+        yield (
+            "search=term",
+            filtered_users({"search": "term"}, backend).limit(5),
+            uses_search_index,
+        )
+        yield (
+            "city=term",
+            filtered_users({"city": "term"}, backend).limit(5),
+            uses_search_index,
+        )
+
+
+def check_query_plans(conn, backend):
+    # Returns [(description, ok, plan)]. On PostgreSQL sequential scans and
+    # sorts are disabled for the check, so a plan without them proves that an
+    # index can serve the query even where a tiny table would be scanned.
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        conn.exec_driver_sql("SET LOCAL enable_sort = off")
+
+    results = []
+    for description, query, predicate in plan_checks(backend):
+        plan = explain(conn, query)
+        results.append((description, predicate(conn, plan), plan))
+    return results
+
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    """EXPLAIN every supported sort/filter query and fail if one misses an index."""
+    backend = search_backend()
+    with db.engine.begin() as conn:
+        results = check_query_plans(conn, backend)
+
+    failed = 0
+    for description, ok, plan in results:
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {description}")
+        if not ok:
+            failed += 1
+            for line in plan:
+                click.echo(f"       {line}")
+    if failed:
+        raise click.ClickException(f"{failed} of {len(results)} queries miss an index")
+    click.echo(f"All {len(results)} queries use an index.")
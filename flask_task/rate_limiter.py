@@ -1,4 +1,6 @@
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import limiter_storage  # noqa: F401 - registers the sqlite:// storage scheme
 
+# Storage, strategy etc. are read from the RATELIMIT_* settings in config_app
 limiter = Limiter(get_remote_address)
@@ -0,0 +1,192 @@
+from bisect import bisect_left
+from time import perf_counter
+from flask import g, has_app_context, request
+from sqlalchemy import event
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteStats:
+    __slots__ = ("buckets", "count", "total", "db_time", "db_queries", "serialize")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.serialize = 0.0
+
+
+class RequestMetrics:
+    # Per-process aggregates keyed by (method, route, status); each worker
+    # process exposes its own numbers
+    def __init__(self):
+        self._routes = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def set_gauge(self, name, value, help_text):
+        with self._lock:
+            self._gauges[name] = (value, help_text)
+
+    def observe(self, key, timing, duration):
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats()
+            stats.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            stats.count += 1
+            stats.total += duration
+            stats.db_time += timing["db_time"]
+            stats.db_queries += timing["db_queries"]
+            stats.serialize += timing["serialize"]
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP http_request_duration_seconds Request handling time",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route, status), stats in routes:
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                    f"{stats.count}"
+                )
+                lines.append(
+                    f"http_request_duration_seconds_sum{{{labels}}} {stats.total}"
+                )
+                lines.append(
+                    f"http_request_duration_seconds_count{{{labels}}} {stats.count}"
+                )
+
+            for name, attribute, help_text in (
+                ("http_request_db_seconds_total", "db_time", "Time spent in SQL"),
+                ("http_request_db_queries_total", "db_queries", "SQL statements run"),
+                (
+                    "http_request_serialize_seconds_total",
+                    "serialize",
+                    "Time spent encoding JSON responses",
+                ),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (method, route, status), stats in routes:
+                    labels = f'method="{method}",route="{route}",status="{status}"'
+                    lines.append(f"{name}{{{labels}}} {getattr(stats, attribute)}")
+
+            for name, (value, help_text) in sorted(self._gauges.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def current_timing():
+    return g.get("_timing") if has_app_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    start = conn.info.pop("query_start", None)
+    if timing is not None and start is not None:
+        timing["db_time"] += perf_counter() - start
+        timing["db_queries"] += 1
+
+
+def timed_json_response(response):
+    # Wraps the app's JSON provider so jsonify() time is attributed to
+    # serialization
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return response(*args, **kwargs)
+        finally:
+            timing = current_timing()
+            if timing is not None:
+                timing["serialize"] += perf_counter() - start
+
+    return wrapper
+
+
+def init_request_metrics(app, engines):
+    # Call after limiter.init_app so the limiter's before_request hook runs
+    # between start_timing and mark_dispatch
+    metrics = RequestMetrics()
+    app.extensions["request_metrics"] = metrics
+    slow_threshold = app.config["METRICS_SLOW_REQUEST_MS"] / 1000
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    app.json.response = timed_json_response(app.json.response)
+
+    def start_timing():
+        g._timing = {
+            "start": perf_counter(),
+            "dispatch": None,
+            "db_time": 0.0,
+            "db_queries": 0,
+            "serialize": 0.0,
+        }
+
+    def mark_dispatch():
+        g._timing["dispatch"] = perf_counter()
+
+    def finish_timing(response):
+        timing = g.pop("_timing", None)
+        if timing is None:
+            return response
+        duration = perf_counter() - timing["start"]
+        before = (timing["dispatch"] or perf_counter()) - timing["start"]
+
+        response.headers["Server-Timing"] = (
+            f'db;dur={timing["db_time"] * 1000:.2f};'
+            f'desc="{timing["db_queries"]} queries", '
+            f'ser;dur={timing["serialize"] * 1000:.2f}, '
+            f"limiter;dur={before * 1000:.2f}, "
+            f"total;dur={duration * 1000:.2f}"
+        )
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe((request.method, route, response.status_code), timing, duration)
+        if duration >= slow_threshold:
+            logger.warning(
+                "Slow request %s %s: %.1fms (db %.1fms in %d queries, "
+                "serialize %.1fms, before-request %.1fms)",
+                request.method,
+                request.full_path,
+                duration * 1000,
+                timing["db_time"] * 1000,
+                timing["db_queries"],
+                timing["serialize"] * 1000,
+                before * 1000,
+            )
+        return response
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timing)
+    app.before_request(mark_dispatch)
+    app.after_request(finish_timing)
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
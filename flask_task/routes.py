@@ -1,13 +1,47 @@
-from flask import Blueprint, jsonify, request
-from sqlalchemy import or_, func
-from models import User
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from sqlalchemy.orm.exc import StaleDataError
 from db_util import db
+from db_pool import pool_stats
+from db_routing import read_only, user_cache_modes
 from rate_limiter import limiter
+from etags import list_etag, not_modified, users_version, with_etag
+from keyset import KeysetError
+from user_api import (
+    REQUEST_ERRORS,
+    SNAPSHOT_DISABLED,
+    batch_response,
+    check_write_payload,
+    parse_analytics_request,
+    parse_batch_request,
+    parse_export_request,
+    parse_list_request,
+    parse_lookup_request,
+    parse_user_request,
+    user_body,
+)
+from serializers import USER_FIELDS
+from user_batch import run_batch, to_values
+from user_export import export_headers, export_stream
+from user_cache import get_user_cache, invalidate_users
+from user_queries import fetch_user, fetch_user_list, fetch_users_by_ids
+from user_stats import read_summary
+from user_writes import delete_user_row, insert_user, update_user_row
 import logging
 
 logger = logging.getLogger(__name__)
 api_routes = Blueprint("api_routes", __name__, url_prefix="/api/v1")
 
+# Validation and response bodies live in user_api.py and the queries in
+# user_queries.py / user_writes.py, shared with the ASGI app (asgi_app.py)
+
 
 # User_controller
 @api_routes.route("/test")
@@ -20,78 +54,63 @@ def test_handler():
 @api_routes.route("/users", methods=["GET"])
 @limiter.limit("100/hour;5/minute")
 def get_users():
-    invalid_params = validate_query_params(request.args.keys())
-    if invalid_params:
-        return (
-            jsonify(
-                {"error": f"Invalid query parameters: {', '.join(invalid_params)}"}
-            ),
-            400,
+    try:
+        params = parse_list_request(request.args, current_app.config)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The ETag is derived from the table's change counter, so an unchanged
+    # result is answered with a 304 before any query or serialization
+    version = users_version()
+    etag = list_etag(request.args, version)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    cache = get_user_cache()
+    if cache:
+        cache_key = cache.list_key(request.args, version)
+        body = cache.get_list(cache_key)
+        if body is not None:
+            return with_etag(jsonify(body), etag), 200
+
+    try:
+        body = fetch_user_list(
+            db.session,
+            params,
+            current_app.config["USER_MULTIGET_CHUNK_SIZE"],
+            count_cache=current_app.extensions["user_counts"],
         )
+    except KeysetError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error fetching users: %s", e)
+        return jsonify({"error": "Failed to fetch users"}), 500
+
+    if cache:
+        cache.set_list(cache_key, body)
+    return with_etag(jsonify(body), etag), 200
+
 
-    page = request.args.get("page", default=1, type=int)
-    limit = request.args.get("limit", default=5, type=int)
-    search = request.args.get("search", default="", type=str).strip()
-    sort = request.args.get("sort", default="id", type=str)
-    city = request.args.get("city", default="", type=str).strip()
+@api_routes.route("/users/lookup", methods=["POST"])
+@read_only
+@limiter.limit("100/hour;5/minute")
+def lookup_users():
+    # Multi-get for id sets too long for a GET /users?ids= URL
+    try:
+        ids, fields = parse_lookup_request(
+            request.args, request.get_json(silent=True), current_app.config
+        )
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        query = db.session.query(User)
-
-        if search:
-            query = query.filter(
-                or_(
-                    User.first_name.ilike(f"%{search}%"),
-                    User.last_name.ilike(f"%{search}%"),
-                )
-            )
-        if city:
-            query = query.filter(
-                or_(
-                    User.city.ilike(f"%{city}%"),
-                )
-            )
-
-        if sort.startswith("-"):
-            sort_field = sort[1:]
-            query = query.order_by(getattr(User, sort_field).desc())
-        else:
-            query = query.order_by(getattr(User, sort).asc())
-
-        paginated_users = query.paginate(page=page, per_page=limit, error_out=False)
-        users = paginated_users.items
-
-        # Use 'paginated_users.items' for data and 'paginated_users' for metadata
-        data = []
-        for user in users:
-            data.append(
-                {
-                    "id": user.id,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "company_name": user.company_name,
-                    "city": user.city,
-                    "state": user.state,
-                    "zip": user.zip,
-                    "email": user.email,
-                    "web": user.web,
-                    "age": user.age,
-                }
-            )
-        return (
-            jsonify(
-                {
-                    "data": data,
-                    "page": paginated_users.page,
-                    "limit": paginated_users.per_page,
-                    "total_pages": paginated_users.pages,
-                    "total_users": paginated_users.total,
-                }
-            ),
-            200,
+        result = fetch_users_by_ids(
+            db.session, ids, current_app.config["USER_MULTIGET_CHUNK_SIZE"], fields
         )
+        return jsonify(result), 200
     except Exception as e:
-        logger.error(f"Error fetching users: {str(e)}")
+        logger.error("Error looking up users: %s", e)
         return jsonify({"error": "Failed to fetch users"}), 500
 
 
@@ -99,34 +118,36 @@ def get_users():
 @limiter.limit("5/minute")
 def get_user_by_id(id):
     try:
-        user = db.session.execute(db.select(User).filter_by(id=id)).scalar_one_or_none()
-        if not user:
-            logger.error(f"Failed to fetch user with id: {id}")
+        fields = parse_user_request(request.args)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache = get_user_cache()
+    lookup, fill = user_cache_modes(g.get("db_replica"), request.cookies)
+    fill = cache and fill
+    if fill:
+        generation = cache.generation()
+    entry = cache.get_user(id) if cache and lookup else None
+
+    if entry is None:
+        try:
+            # The cache holds full users, so only a read that does not fill
+            # it is narrowed
+            entry = fetch_user(db.session, id, USER_FIELDS if fill else fields)
+        except Exception as e:
+            logger.error("Error fetching user %s: %s", id, e)
+            return jsonify({"error": f"Failed to get user: {str(e)}"}), 500
+        if entry is None:
+            logger.error("Failed to fetch user with id: %s", id)
             return jsonify({"error": "User not found"}), 404
+        if fill:
+            cache.set_user(id, entry, generation)
 
-        return (
-            jsonify(
-                {
-                    "data": {
-                        "id": user.id,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "company_name": user.company_name,
-                        "city": user.city,
-                        "state": user.state,
-                        "zip": user.zip,
-                        "email": user.email,
-                        "web": user.web,
-                        "age": user.age,
-                    }
-                }
-            ),
-            200,
-        )
-
-    except Exception as e:
-        logger.error(f"Error fetching user {id}: {str(e)}")
-        return jsonify({"error": f"Failed to get user: {str(e)}"}), 500
+    body, etag = user_body(entry, fields)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    return with_etag(jsonify(body), etag), 200
 
 
 @api_routes.route("/users", methods=["POST"])
@@ -135,269 +156,159 @@ def create_user():
         data = request.get_json()
         logger.info("Creating user with JSON payload received")
 
-        broken_payload = validate_payload(data)
+        broken_payload = check_write_payload(data, full=True)
         if broken_payload:
             return jsonify(broken_payload), 400
 
-        new_user = User(
-            first_name=data.get("first_name"),
-            last_name=data.get("last_name"),
-            company_name=data.get("company_name"),
-            city=data.get("city"),
-            state=data.get("state"),
-            zip=int(data.get("zip")),
-            email=data.get("email"),
-            web=data.get("web"),
-            age=int(data.get("age")),
-        )
-
-        db.session.add(new_user)
+        user, etag = insert_user(db.session, to_values(data, full=True))
         db.session.commit()
+        invalidate_users()
 
-        logger.info(f"User created succcessfully. ID:{new_user.id}")
-        return (
-            jsonify(
-                {
-                    "data": {
-                        "id": new_user.id,
-                        "first_name": new_user.first_name,
-                        "last_name": new_user.last_name,
-                        "company_name": new_user.company_name,
-                        "city": new_user.city,
-                        "state": new_user.state,
-                        "zip": new_user.zip,
-                        "email": new_user.email,
-                        "web": new_user.web,
-                        "age": new_user.age,
-                    },
-                }
-            ),
-            201,
-        )
+        logger.info("User created succcessfully. ID:%s", user["id"])
+        return with_etag(jsonify({"data": user}), etag), 201
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error creating new user: {str(e)}")
+        logger.error("Error creating new user: %s", e)
         return jsonify({"error": f"Failed to create new user: {str(e)}"}), 500
 
 
 @api_routes.route("/users/<int:id>", methods=["PUT"])
 def update_user(id):
+    return write_user(id, full=True)
+
+
+@api_routes.route("/users/<int:id>", methods=["PATCH"])
+def partial_update_user(id):
+    return write_user(id, full=False)
+
+
+def write_user(id, full):
+    # PUT (full) or PATCH, see user_writes.py
     try:
         data = request.get_json()
-        logger.info(f"Received update data: {data}")
-
-        broken_payload = validate_payload(data)
+        logger.debug("Received update data: %s", data)
+        broken_payload = check_write_payload(data, full)
         if broken_payload:
             return jsonify(broken_payload), 400
 
-        user = db.session.execute(db.select(User).filter_by(id=id)).scalar_one_or_none()
-        if not user:
-            logger.warning(f"User not found. ID: {id}")
+        result = update_user_row(
+            db.session, id, to_values(data, full), request.if_match
+        )
+        if result is None:
+            logger.warning("User not found. ID: %s", id)
             return jsonify({"error": "User not found"}), 404
-
-        user.first_name = data.get("first_name")
-        user.last_name = data.get("last_name")
-        user.company_name = data.get("company_name")
-        user.city = data.get("city")
-        user.state = data.get("state")
-        user.zip = int(data.get("zip"))
-        user.email = data.get("email")
-        user.web = data.get("web")
-        user.age = int(data.get("age"))
+        if result is False:
+            db.session.rollback()
+            return jsonify({"error": "User was modified (ETag mismatch)"}), 412
 
         db.session.commit()
+        invalidate_users(id)
         logger.info("User update successfull")
-        return (
-            jsonify(
-                {
-                    "data": {
-                        "id": user.id,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "company_name": user.company_name,
-                        "city": user.city,
-                        "state": user.state,
-                        "zip": user.zip,
-                        "email": user.email,
-                        "web": user.web,
-                        "age": user.age,
-                    }
-                }
-            ),
-            200,
-        )
+        user, etag = result
+        return with_etag(jsonify({"data": user}), etag), 200
 
-    except Exception as e:
+    except StaleDataError:
         db.session.rollback()
-        logger.error(f"Error updating user {id}: {str(e)}")
-        return jsonify({"error": f"Failed to update user: {str(e)}"}), 500
-
-
-@api_routes.route("/users/<int:id>", methods=["PATCH"])
-def partial_update_user(id):
-    try:
-        data = request.get_json()
-        unexpected_payload = check_unexpected_fields(data)
-        if unexpected_payload:
-            return jsonify(unexpected_payload), 400
-
-        user = db.session.execute(db.select(User).filter_by(id=id)).scalar_one_or_none()
-        if not user:
-            logger.warning(f"User not found. ID: {id}")
-            return jsonify({"error": "User not found"}), 404
-
-        user.first_name = data.get("first_name", user.first_name)
-        user.last_name = data.get("last_name", user.last_name)
-        user.company_name = data.get("company_name", user.company_name)
-        user.city = data.get("city", user.city)
-        user.state = data.get("state", user.state)
-        user.zip = data.get("zip", user.zip)
-        user.email = data.get("email", user.email)
-        user.web = data.get("web", user.web)
-        user.age = data.get("age", user.age)
-
-        db.session.commit()
-        logging.info("User update successfull")
-
-        return (
-            jsonify(
-                {
-                    "data": {
-                        "id": user.id,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "company_name": user.company_name,
-                        "city": user.city,
-                        "state": user.state,
-                        "zip": user.zip,
-                        "email": user.email,
-                        "web": user.web,
-                        "age": user.age,
-                    }
-                }
-            ),
-            200,
-        )
+        logger.warning("Concurrent update of user %s rejected", id)
+        return jsonify({"error": "User was modified concurrently"}), 409
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error updating user {id}: {str(e)}")
+        logger.error("Error updating user %s: %s", id, e)
         return jsonify({"error": f"Failed to update user: {str(e)}"}), 500
 
 
 @api_routes.route("/users/<int:id>", methods=["DELETE"])
 def delete_user(id):
     try:
-        user = db.session.execute(db.select(User).filter_by(id=id)).scalar_one_or_none()
-        if not user:
-            logger.warning(f"User not found. ID: {id}")
+        if not delete_user_row(db.session, id):
+            logger.warning("User not found. ID: %s", id)
             return jsonify({"message": "User not found"}), 404
 
-        db.session.delete(user)
         db.session.commit()
+        invalidate_users(id)
 
         return jsonify({"message": "User deleted successfully"}), 200
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error deleting user {id}: {str(e)}")
+        logger.error("Error deleting user %s: %s", id, e)
         return jsonify({"error": f"Failed to delete user: {str(e)}"}), 500
 
 
+@api_routes.route("/users/batch", methods=["POST"])
+def batch_users():
+    operations = request.get_json(silent=True)
+    try:
+        results, valid, chunk_size = parse_batch_request(
+            operations, request.args, current_app.config
+        )
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    results.update(run_batch(valid, chunk_size))
+    logger.info(
+        "Batch processed: %s of %s operations valid", len(valid), len(operations)
+    )
+    return jsonify(batch_response(operations, results)), 200
+
+
+@api_routes.route("/users/export", methods=["GET"])
+@limiter.limit("10/hour")
+def export_users():
+    try:
+        fmt, fields, query = parse_export_request(request.args)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The body is produced while the client reads it; the request context
+    # (and with it db.session) stays open until the generator is exhausted
+    chunks = export_stream(
+        db.session, query, fmt, current_app.config["USER_EXPORT_BATCH_SIZE"], fields
+    )
+    mimetype, headers = export_headers(fmt)
+
+    logger.info("Exporting users as %s", fmt)
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+@api_routes.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    cache = get_user_cache()
+    return jsonify({"data": cache.stats() if cache else None}), 200
+
+
+@api_routes.route("/pool/stats", methods=["GET"])
+def get_pool_stats():
+    # Connection pools of this worker process
+    data = pool_stats(db.engine)
+    replicas = current_app.extensions["db_replicas"]
+    if replicas:
+        data["replicas"] = {key: pool_stats(db.engines[key]) for key in replicas}
+    return jsonify({"data": data}), 200
+
+
 @api_routes.route("/users/summary", methods=["GET"])
 @limiter.limit("5/minute")
 def get_statistics():
-    city_count = (
-        db.session.query(User.city, func.count(User.id)).group_by(User.city).all()
-    )
-    state_count = (
-        db.session.query(User.state, func.count(User.id)).group_by(User.state).all()
-    )
-    avg_age = db.session.query(func.avg(User.age)).scalar()
-    max_age = db.session.query(func.max(User.age)).scalar()
-    min_age = db.session.query(func.min(User.age)).scalar()
-
-    return (
-        jsonify(
-            {
-                "data": {
-                    "count_by_city": {city: count for city, count in city_count},
-                    "count_by_state": {state: count for state, count in state_count},
-                    "avg_age": round(avg_age, 2) if avg_age else None,
-                    "max_age": max_age,
-                    "min_age": min_age,
-                }
-            }
-        ),
-        200,
-    )
+    # Served from the rollup tables: O(number of groups), no scan of users
+    return jsonify({"data": read_summary()}), 200
 
 
-# utils
-def validate_query_params(params):
-    allowed_params = {"page", "limit", "sort", "search", "city"}
-    unexpected_params = set(params) - allowed_params
-
-    return unexpected_params if unexpected_params else None
-
-
-def validate_payload(data):
-    required_fields = {
-        "first_name",
-        "last_name",
-        "company_name",
-        "city",
-        "state",
-        "zip",
-        "email",
-        "web",
-        "age",
-    }
-
-    missing_fields = [
-        field
-        for field in required_fields
-        if field not in data or data.get(field) is None
-    ]
-    unexpected_fields = set(data) - required_fields
-    logger.info(missing_fields)
-
-    errors = []
-    if missing_fields:
-        errors.append(f"Missing required fields: {', '.join(missing_fields)}")
-        logger.warning(f"Request payload incomplete. Missing fields: {missing_fields}")
-
-    if unexpected_fields:
-        errors.append(f"Unexpected fields: {', '.join(unexpected_fields)}")
-        logger.warning(f"Request payload with unexpected fields: {unexpected_fields}")
-
-    if errors:
-        return {"error": " | ".join(errors)}, 400
-
-    return None
-
-
-def check_unexpected_fields(data):
-    allowed_fields = {
-        "first_name",
-        "last_name",
-        "company_name",
-        "city",
-        "state",
-        "zip",
-        "email",
-        "web",
-        "age",
-    }
-    unexpected_fields = set(data) - allowed_fields
-    errors = []
-
-    if unexpected_fields:
-        errors.append(f"Unexpected fields: {', '.join(unexpected_fields)}")
-        logger.warning(f"Request payload with unexpected fields: {unexpected_fields}")
-
-    if errors:
-        return {"error": " | ".join(errors)}, 400
-
-    return None
+@api_routes.route("/users/analytics", methods=["GET"])
+@limiter.limit("5/minute")
+def get_analytics():
+    # Aggregates over the in-process columnar snapshot, brought up to date
+    # with the rows that changed since the last request
+    snapshot = current_app.extensions["user_snapshot"]
+    if snapshot is None:
+        return jsonify({"error": SNAPSHOT_DISABLED}), 503
+    try:
+        filters, group_by, bin_width = parse_analytics_request(request.args)
+    except REQUEST_ERRORS as e:
+        return jsonify({"error": str(e)}), 400
+
+    snapshot.refresh(db.session)
+    data = snapshot.analyze(filters, group_by, bin_width)
+    return jsonify({"data": data, "snapshot": snapshot.stats()}), 200
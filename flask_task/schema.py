@@ -0,0 +1,69 @@
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.schema import CreateColumn, CreateTable
+from db_util import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema(conn):
+    # db.create_all() only creates missing tables. Add the columns and indexes
+    # that were introduced after a table was first created; new columns must
+    # be nullable or carry a server default so existing rows stay valid.
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            logger.info("Added column %s.%s", table.name, column.name)
+
+        if needs_autoincrement(conn, table):
+            rebuild_table(conn, table)
+            continue
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+                logger.info("Created index %s", index.name)
+
+
+def needs_autoincrement(conn, table):
+    # SQLite hands out the id of the last deleted row again unless the table
+    # was created with AUTOINCREMENT, which ALTER TABLE cannot add
+    if conn.dialect.name != "sqlite":
+        return False
+    if not table.dialect_options["sqlite"]["autoincrement"]:
+        return False
+    ddl = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": table.name},
+    ).scalar()
+    return "AUTOINCREMENT" not in ddl.upper()
+
+
+def rebuild_table(conn, table):
+    # SQLite's procedure for schema changes ALTER TABLE cannot make: copy the
+    # rows into a table created from the model, drop the old one and rename.
+    # Its indexes are recreated here; triggers (the FTS ones) are recreated by
+    # search_index.setup_search_index, which runs after upgrade_schema.
+    staging = table.to_metadata(MetaData(), name=f"{table.name}_rebuild")
+    columns = ", ".join(column.name for column in table.columns)
+    conn.execute(CreateTable(staging))
+    conn.execute(
+        text(
+            f"INSERT INTO {staging.name} ({columns}) SELECT {columns} FROM {table.name}"
+        )
+    )
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {staging.name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+    logger.info("Rebuilt table %s", table.name)
@@ -0,0 +1,131 @@
+from flask import current_app
+from sqlalchemy import column, or_, select, table, text, union_all
+from sqlalchemy.exc import SQLAlchemyError
+from models import User
+from db_util import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = ("first_name", "last_name", "city")
+# Trigram indexes cannot answer patterns shorter than one trigram
+MIN_TERM_LENGTH = 3
+
+users_fts = table("users_fts", column("rowid"), *(column(c) for c in SEARCH_COLUMNS))
+
+SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE users_fts USING fts5(
+        first_name, last_name, city,
+        content='users', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, first_name, last_name, city)
+        VALUES (new.id, new.first_name, new.last_name, new.city);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, first_name, last_name, city)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.city);
+    END
+    """,
+    # Only writes to an indexed column touch the index. Recreated on every
+    # setup, so databases with the earlier AFTER UPDATE trigger get this one.
+    "DROP TRIGGER IF EXISTS users_fts_au",
+    """
+    CREATE TRIGGER users_fts_au
+    AFTER UPDATE OF first_name, last_name, city ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, first_name, last_name, city)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.city);
+        INSERT INTO users_fts(rowid, first_name, last_name, city)
+        VALUES (new.id, new.first_name, new.last_name, new.city);
+    END
+    """,
+]
+
+POSTGRES_TRGM_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_users_{name}_trgm "
+    f"ON users USING gin ({name} gin_trgm_ops)"
+    for name in SEARCH_COLUMNS
+]
+
+
+def setup_search_index(conn):
+    # Make sure the trigram index for conn's database exists and return the
+    # backend name: "fts5" filters through the SQLite side table, "pg_trgm"
+    # and "scan" keep the plain ILIKE filters (indexed on Postgres, full scan
+    # otherwise).
+    if conn.dialect.name == "sqlite":
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+        ).first()
+        if not exists:
+            conn.execute(text(SQLITE_FTS_DDL[0]))
+            conn.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+        for ddl in SQLITE_FTS_DDL[1:]:
+            conn.execute(text(ddl))
+        return "fts5"
+    if conn.dialect.name == "postgresql":
+        for ddl in POSTGRES_TRGM_DDL:
+            conn.execute(text(ddl))
+        return "pg_trgm"
+    return "scan"
+
+
+def init_search_index(app, engine):
+    try:
+        with engine.begin() as conn:
+            backend = setup_search_index(conn)
+    except SQLAlchemyError as e:
+        logger.warning("Trigram search index unavailable, using table scans: %s", e)
+        backend = "scan"
+
+    app.extensions["user_search"] = backend
+    logger.info("User search backend: %s", backend)
+    return backend
+
+
+def detect_search_backend(conn):
+    # Backend of a database that was already set up, without running DDL
+    if conn.dialect.name == "sqlite":
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+        ).first()
+        return "fts5" if exists else "scan"
+    if conn.dialect.name == "postgresql":
+        return "pg_trgm"
+    return "scan"
+
+
+def search_backend():
+    # Detected on first use when the app started without init_search_index
+    backend = current_app.extensions.get("user_search")
+    if backend is None:
+        with db.engine.connect() as conn:
+            backend = detect_search_backend(conn)
+        current_app.extensions["user_search"] = backend
+        logger.info("User search backend: %s", backend)
+    return backend
+
+
+def filter_by_terms(query, term, fields, backend=None):
+    # Substring match of term against any of fields, served by the trigram
+    # index when one is available and the term is long enough to use it
+    if backend is None:
+        backend = search_backend()
+    if backend == "fts5" and len(term) >= MIN_TERM_LENGTH:
+        # One LIKE per subquery: FTS5 only plans single-column LIKE constraints
+        matches = union_all(
+            *(
+                select(users_fts.c.rowid).where(users_fts.c[field].like(f"%{term}%"))
+                for field in fields
+            )
+        )
+        return query.filter(User.id.in_(matches))
+
+    return query.filter(
+        or_(*(getattr(User, field).ilike(f"%{term}%") for field in fields))
+    )
@@ -0,0 +1,56 @@
+from operator import attrgetter
+from models import User
+
+# Column order of the users table drives both the SELECT list and the keys of
+# the serialized dict, so rows can be zipped straight into JSON-ready dicts.
+# The internal version column is not part of the representation.
+USER_FIELDS = tuple(
+    column.key for column in User.__table__.columns if column.key != "version"
+)
+USER_COLUMNS = tuple(getattr(User, field) for field in USER_FIELDS)
+
+_get_user_fields = attrgetter(*USER_FIELDS)
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def parse_fields(value):
+    # "email,city" -> ("id", "email", "city") in column order; id is always
+    # part of the representation. None or "" selects every field.
+    if not value:
+        return USER_FIELDS
+    requested = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = requested - set(USER_FIELDS)
+    if unknown:
+        raise FieldsError(
+            f"Invalid fields: {', '.join(sorted(unknown))}. "
+            f"Expected any of: {', '.join(USER_FIELDS)}"
+        )
+    return tuple(field for field in USER_FIELDS if field in requested or field == "id")
+
+
+def user_columns(fields=USER_FIELDS):
+    return tuple(getattr(User, field) for field in fields)
+
+
+def serialize_row(row, fields=USER_FIELDS):
+    # row comes from a select(*user_columns(fields)); no ORM object is
+    # hydrated. Extra trailing columns (e.g. a cursor's sort key) are ignored.
+    return dict(zip(fields, row))
+
+
+def serialize_rows(rows, fields=USER_FIELDS):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def select_fields(data, fields=USER_FIELDS):
+    # Narrow an already serialized user to fields
+    if fields is USER_FIELDS:
+        return data
+    return {field: data[field] for field in fields}
+
+
+def serialize_user(user):
+    return dict(zip(USER_FIELDS, _get_user_fields(user)))
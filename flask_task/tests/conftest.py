@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app modules import each other as top-level modules
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The WSGI app on a fresh SQLite database, seeded from users.json
+    monkeypatch.chdir(APP_DIR)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'users.db'}")
+    monkeypatch.setenv("DATABASE_REPLICA_URLS", "")
+    monkeypatch.setenv("RATELIMIT_STORAGE_URI", "memory://")
+    monkeypatch.setenv("RATELIMIT_ENABLED", "0")
+    monkeypatch.setenv("USER_CACHE_BACKEND", "memory")
+    monkeypatch.setenv("DB_INIT", "auto")
+    from main import config_app
+
+    return config_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,47 @@
+USER = {
+    "first_name": "Ada",
+    "last_name": "Lovelace",
+    "company_name": "Analytical Engines",
+    "city": "London",
+    "state": "NY",
+    "zip": 10001,
+    "email": "ada@example.com",
+    "web": "http://example.com",
+    "age": 36,
+}
+
+
+def get_compressed(client, app, path):
+    app.config["COMPRESSION_MIN_SIZE"] = 0
+    response = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    return response
+
+
+def test_compressed_user_etag_is_weak(client, app):
+    response = get_compressed(client, app, "/api/v1/users/1")
+    assert response.headers["ETag"].startswith('W/"u1.')
+
+
+def test_write_with_etag_of_compressed_get(client, app):
+    etag = get_compressed(client, app, "/api/v1/users/1").headers["ETag"]
+
+    response = client.put("/api/v1/users/1", json=USER, headers={"If-Match": etag})
+    assert response.status_code == 200
+
+    # The write bumped the version, so the same ETag is now stale
+    response = client.patch(
+        "/api/v1/users/1", json={"age": 37}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+
+
+def test_patch_with_etag_of_compressed_get(client, app):
+    etag = get_compressed(client, app, "/api/v1/users/2").headers["ETag"]
+
+    response = client.patch(
+        "/api/v1/users/2", json={"city": "Paris"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["data"]["city"] == "Paris"
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import text
+from db_util import db
+from models import User
+from query_plans import check_query_plans
+from search_index import search_backend
+
+
+def failed_checks(app):
+    with app.app_context():
+        backend = search_backend()
+        with db.engine.begin() as conn:
+            results = check_query_plans(conn, backend)
+    return [description for description, ok, plan in results if not ok]
+
+
+def test_every_list_query_uses_an_index(app):
+    assert failed_checks(app) == []
+
+
+@pytest.mark.parametrize(
+    "index", sorted(index.name for index in User.__table__.indexes)
+)
+def test_dropped_index_is_detected(app, index):
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {index}"))
+    assert failed_checks(app)
+
+
+def test_check_query_plans_command(app):
+    result = app.test_cli_runner().invoke(args=["check-query-plans"])
+    assert result.exit_code == 0, result.output
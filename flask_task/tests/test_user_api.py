@@ -0,0 +1,42 @@
+import pytest
+
+USER = {
+    "first_name": "Ada",
+    "last_name": "Lovelace",
+    "company_name": "Analytical Engines",
+    "city": "London",
+    "state": "NY",
+    "zip": 10001,
+    "email": "ada@example.com",
+    "web": "http://example.com",
+    "age": 36,
+}
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("age", "abc"),
+        ("age", -1),
+        ("age", 3e9),
+        ("zip", 100000),
+        ("zip", None),
+    ],
+)
+def test_invalid_integer_fields_are_rejected_by_every_write(client, field, value):
+    data = {**USER, field: value}
+    assert client.post("/api/v1/users", json=data).status_code == 400
+    assert client.put("/api/v1/users/1", json=data).status_code == 400
+    assert client.patch("/api/v1/users/1", json={field: value}).status_code == 400
+
+    response = client.post(
+        "/api/v1/users/batch",
+        json=[{"op": "patch", "id": 1, "data": {field: value}}],
+    )
+    assert response.get_json()["results"][0]["status"] == 400
+
+
+def test_valid_write_is_accepted(client):
+    response = client.post("/api/v1/users", json=USER)
+    assert response.status_code == 201
+    assert response.get_json()["data"]["age"] == 36
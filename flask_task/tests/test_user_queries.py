@@ -0,0 +1,33 @@
+import json
+import pytest
+from user_queries import FilterError, parse_filters, parse_ids
+from werkzeug.datastructures import MultiDict
+
+
+def test_parse_ids_keeps_first_occurrence():
+    assert parse_ids("3,1,3,2".split(","), 10) == [3, 1, 2]
+
+
+@pytest.mark.parametrize("value", ["99999999999999999999999", str(-(2**63) - 1)])
+def test_parse_ids_rejects_ids_outside_int64(value):
+    with pytest.raises(FilterError):
+        parse_ids(["1", value], 10)
+    with pytest.raises(FilterError):
+        parse_ids([1, int(value)], 10)
+
+
+def test_parse_filters_rejects_age_outside_int64():
+    with pytest.raises(FilterError):
+        parse_filters(MultiDict({"age_min": str(2**63)}))
+
+
+def test_list_with_huge_id_is_a_bad_request(client):
+    response = client.get("/api/v1/users?ids=1,99999999999999999999999")
+    assert response.status_code == 400
+
+    response = client.post(
+        "/api/v1/users/lookup",
+        data=json.dumps({"ids": [1, 2**63]}),
+        content_type="application/json",
+    )
+    assert response.status_code == 400
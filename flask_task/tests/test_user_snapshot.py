@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from user_snapshot import UserSnapshot  # noqa: E402
+
+
+def snapshot_of(rows):
+    # rows: (id, version, age, zip, city, state)
+    snapshot = UserSnapshot()
+    snapshot.columns = snapshot._encode(rows)
+    return snapshot
+
+
+def test_age_stats_and_histogram():
+    snapshot = snapshot_of(
+        [(i, 1, age, 10001, "A", "NY") for i, age in enumerate([20, 25, 31, 31, 58])]
+    )
+    result = snapshot.analyze({}, bin_width=10)
+    assert result["age"] == {"min": 20, "max": 58, "mean": 33.0, "p50": 31, "p90": 58}
+    assert result["age_histogram"] == [
+        {"from": 20, "to": 29, "count": 2},
+        {"from": 30, "to": 39, "count": 2},
+        {"from": 50, "to": 59, "count": 1},
+    ]
+
+
+def test_huge_ages_and_zips_are_counted_without_a_dense_array():
+    snapshot = snapshot_of(
+        [
+            (1, 1, 3_000_000_000, 99_999_999_999, "A", "NJ"),
+            (2, 1, 400_000_000, 8_001, "B", "NY"),
+            (3, 1, None, None, None, None),
+        ]
+    )
+    result = snapshot.analyze({}, group_by="zip", bin_width=10)
+    assert result["age"]["max"] == 3_000_000_000
+    assert [entry["count"] for entry in result["age_histogram"]] == [1, 1]
+    assert result["groups"] == [
+        {"name": "080", "count": 1},
+        {"name": "999999999", "count": 1},
+    ]
@@ -0,0 +1,275 @@
+from etags import sparse_etag
+from keyset import KeysetError, sort_column, sort_ordering
+from serializers import USER_FIELDS, FieldsError, parse_fields, select_fields
+from user_counts import CountModeError, parse_count_mode
+from user_export import EXPORT_FORMATS
+from user_queries import (
+    ZIP_DIGITS,
+    FilterError,
+    filtered_users,
+    parse_filters,
+    parse_ids,
+)
+from user_snapshot import AnalyticsError, parse_bin_width, parse_group_by
+import logging
+
+# Request validation and response bodies of the /api/v1 user endpoints,
+# shared by the WSGI routes and the ASGI app so that only the session and
+# await layer differs between them. The parse_* functions raise one of
+# REQUEST_ERRORS, which both apps answer with a 400.
+
+logger = logging.getLogger(__name__)
+
+BATCH_OPERATIONS = ("create", "update", "patch", "delete")
+FILTER_PARAMS = {"search", "city", "state", "zip", "age_min", "age_max"}
+LIST_PARAMS = {"page", "limit", "sort", "cursor", "fields", "count", "ids"}
+LIST_PARAMS |= FILTER_PARAMS
+EXPORT_PARAMS = {"format", "sort", "fields"} | FILTER_PARAMS
+MULTIGET_PARAMS = {"ids", "fields"}
+ANALYTICS_PARAMS = {"group_by", "bin_width", "state", "zip", "age_min", "age_max"}
+SNAPSHOT_DISABLED = (
+    "User snapshot is disabled (needs USER_SNAPSHOT_ENABLED=1 and numpy)"
+)
+# Accepted values of the integer payload fields: five-digit zips (see
+# user_queries.zip_range) and plausible ages
+INTEGER_RANGES = {"zip": range(10**ZIP_DIGITS), "age": range(151)}
+PAYLOAD_FIELDS = {
+    "first_name",
+    "last_name",
+    "company_name",
+    "city",
+    "state",
+    "zip",
+    "email",
+    "web",
+    "age",
+}
+
+
+class RequestError(ValueError):
+    pass
+
+
+REQUEST_ERRORS = (
+    RequestError,
+    KeysetError,
+    FieldsError,
+    CountModeError,
+    FilterError,
+    AnalyticsError,
+)
+
+
+def check_params(args, allowed):
+    invalid_params = set(args) - allowed
+    if invalid_params:
+        raise RequestError(f"Invalid query parameters: {', '.join(invalid_params)}")
+
+
+def parse_list_request(args, config):
+    # GET /users: the arguments of user_queries.fetch_user_list
+    check_params(args, LIST_PARAMS)
+    cursor = args.get("cursor", default=None, type=str)
+    ids = args.get("ids", default=None, type=str)
+    if cursor is not None and "page" in args:
+        raise RequestError("Use either 'page' or 'cursor', not both")
+    if ids is not None and set(args) - MULTIGET_PARAMS:
+        raise RequestError("'ids' can only be combined with 'fields'")
+
+    params = {
+        "page": args.get("page", default=1, type=int),
+        "limit": args.get("limit", default=5, type=int),
+        "sort": args.get("sort", default="id", type=str),
+        "cursor": cursor,
+    }
+    sort_column(params["sort"])
+    params["fields"] = parse_fields(args.get("fields"))
+    params["count"] = parse_count_mode(args.get("count"))
+    params["filters"] = parse_filters(args)
+    if ids is not None:
+        ids = parse_ids(ids.split(","), config["USER_MULTIGET_MAX_IDS"])
+    params["ids"] = ids
+    if cursor is not None and params["limit"] < 1:
+        raise RequestError("'limit' must be a positive integer")
+    return params
+
+
+def parse_lookup_request(args, body, config):
+    # POST /users/lookup: (ids, fields) for a JSON body {"ids": [...]}
+    check_params(args, {"fields"})
+    if not isinstance(body, dict) or not isinstance(body.get("ids"), list):
+        raise RequestError("Request body must be a JSON object with an 'ids' array")
+    fields = parse_fields(args.get("fields"))
+    return parse_ids(body["ids"], config["USER_MULTIGET_MAX_IDS"]), fields
+
+
+def parse_user_request(args):
+    # GET /users/<id>: the requested fields
+    check_params(args, {"fields"})
+    return parse_fields(args.get("fields"))
+
+
+def user_body(entry, fields):
+    # Response body and ETag for fields of a cached or fetched user entry,
+    # {"data": full or narrowed user, "etag": ETag of the full user}
+    sparse = fields if fields is not USER_FIELDS else None
+    data = select_fields(entry["data"], fields)
+    return {"data": data}, sparse_etag(entry["etag"], sparse)
+
+
+def parse_export_request(args, backend=None):
+    # GET /users/export: (format, fields, ordered query)
+    check_params(args, EXPORT_PARAMS)
+    fmt = args.get("format", default="ndjson", type=str)
+    if fmt not in EXPORT_FORMATS:
+        raise RequestError(
+            f"Invalid format. Expected one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    ordering = sort_ordering(args.get("sort", default="id", type=str))
+    fields = parse_fields(args.get("fields"))
+    query = filtered_users(parse_filters(args), backend, fields)
+    return fmt, fields, query.order_by(*ordering)
+
+
+def parse_batch_request(operations, args, config):
+    # POST /users/batch: ({index: result} of the invalid items, the valid
+    # (index, operation) pairs, chunk size). Invalid items are reported
+    # without being executed; the rest are applied as bulk statements, one
+    # transaction per chunk.
+    if not isinstance(operations, list):
+        raise RequestError("Request body must be a JSON array of operations")
+    max_operations = config["USER_BATCH_MAX_OPERATIONS"]
+    if len(operations) > max_operations:
+        raise RequestError(f"A batch may contain at most {max_operations} operations")
+    chunk_size = args.get(
+        "chunk_size", default=config["USER_BATCH_CHUNK_SIZE"], type=int
+    )
+    if chunk_size < 1:
+        raise RequestError("'chunk_size' must be a positive integer")
+
+    results = {}
+    valid = []
+    seen_ids = set()
+    for index, operation in enumerate(operations):
+        error = validate_batch_operation(operation)
+        if not error and operation["op"] != "create":
+            if operation["id"] in seen_ids:
+                error = f"User {operation['id']} appears more than once in the batch"
+            seen_ids.add(operation["id"])
+        if error:
+            results[index] = {"status": 400, "error": error}
+        else:
+            valid.append((index, operation))
+    return results, valid, chunk_size
+
+
+def batch_response(operations, results):
+    return {
+        "results": [
+            {
+                "index": index,
+                "op": operation.get("op") if isinstance(operation, dict) else None,
+                **results[index],
+            }
+            for index, operation in enumerate(operations)
+        ]
+    }
+
+
+def parse_analytics_request(args):
+    # GET /users/analytics: (filters, group_by, bin_width)
+    check_params(args, ANALYTICS_PARAMS)
+    filters = parse_filters(args)
+    group_by = parse_group_by(args.get("group_by"))
+    return filters, group_by, parse_bin_width(args.get("bin_width"))
+
+
+def validate_payload(data):
+    missing_fields = [
+        field
+        for field in PAYLOAD_FIELDS
+        if field not in data or data.get(field) is None
+    ]
+    unexpected_fields = set(data) - PAYLOAD_FIELDS
+    logger.debug("Missing fields: %s", missing_fields)
+
+    errors = []
+    if missing_fields:
+        errors.append(f"Missing required fields: {', '.join(missing_fields)}")
+        logger.warning("Request payload incomplete. Missing fields: %s", missing_fields)
+
+    if unexpected_fields:
+        errors.append(f"Unexpected fields: {', '.join(unexpected_fields)}")
+        logger.warning("Request payload with unexpected fields: %s", unexpected_fields)
+
+    if errors:
+        return {"error": " | ".join(errors)}, 400
+
+    return None
+
+
+def check_unexpected_fields(data):
+    unexpected_fields = set(data) - PAYLOAD_FIELDS
+    errors = []
+
+    if unexpected_fields:
+        errors.append(f"Unexpected fields: {', '.join(unexpected_fields)}")
+        logger.warning("Request payload with unexpected fields: %s", unexpected_fields)
+
+    if errors:
+        return {"error": " | ".join(errors)}, 400
+
+    return None
+
+
+def check_write_payload(data, full):
+    # PUT and POST replace every field; PATCH may send any subset of them.
+    # Every column is NOT NULL and zip and age must be integers in
+    # INTEGER_RANGES (converted by user_batch.to_values).
+    broken_payload = validate_payload(data) if full else check_unexpected_fields(data)
+    if broken_payload:
+        return broken_payload
+
+    null_fields = [
+        field for field in PAYLOAD_FIELDS if field in data and data[field] is None
+    ]
+    if null_fields:
+        return {"error": f"Fields cannot be null: {', '.join(null_fields)}"}, 400
+
+    for field, valid in INTEGER_RANGES.items():
+        if field not in data:
+            continue
+        try:
+            value = int(data[field])
+        except (TypeError, ValueError, OverflowError):
+            return {"error": f"'{field}' must be an integer"}, 400
+        if value not in valid:
+            return {
+                "error": f"'{field}' must be between {valid.start} and {valid.stop - 1}"
+            }, 400
+
+    return None
+
+
+def validate_batch_operation(operation):
+    if not isinstance(operation, dict):
+        return "Operation must be an object"
+
+    op = operation.get("op")
+    if op not in BATCH_OPERATIONS:
+        return f"Invalid op: {op}. Expected one of: {', '.join(BATCH_OPERATIONS)}"
+
+    if op != "create" and not isinstance(operation.get("id"), int):
+        return f"'{op}' requires an integer 'id'"
+    if op == "delete":
+        return None
+
+    data = operation.get("data")
+    if not isinstance(data, dict):
+        return f"'{op}' requires a 'data' object"
+
+    broken_payload = check_write_payload(data, full=op != "patch")
+    if broken_payload:
+        return broken_payload[0]["error"]
+
+    return None
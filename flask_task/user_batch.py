@@ -0,0 +1,99 @@
+from sqlalchemy import delete, insert, select, update
+from models import User
+from db_util import db
+from etags import bump_users_version
+from serializers import USER_FIELDS
+from user_cache import invalidate_users
+from user_stats import apply_changes, row_stat_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def to_values(data, full):
+    values = {field: data.get(field) for field in USER_FIELDS if field != "id"}
+    if not full:
+        values = {field: value for field, value in values.items() if field in data}
+    for field in ("zip", "age"):
+        if values.get(field) is not None:
+            values[field] = int(values[field])
+    return values
+
+
+def run_chunk(session, items):
+    # Apply one chunk of validated (index, operation) pairs as bulk statements
+    # on session and return ({index: result}, ids of changed users). The
+    # caller commits.
+    results = {}
+    creates = [(index, item) for index, item in items if item["op"] == "create"]
+    writes = [(index, item) for index, item in items if item["op"] != "create"]
+
+    ids = {item["id"] for _, item in writes}
+    existing = {}
+    if ids:
+        rows = session.execute(select(User.__table__).where(User.id.in_(ids)))
+        existing = {row.id: dict(row._mapping) for row in rows}
+
+    stat_changes = []
+    updates, deletes = [], []
+    for index, item in writes:
+        before = existing.get(item["id"])
+        if before is None:
+            results[index] = {"status": 404, "error": "User not found"}
+            continue
+
+        stat_changes.append((row_stat_key(before), -1))
+        if item["op"] == "delete":
+            deletes.append(item["id"])
+            results[index] = {"status": 200, "id": item["id"]}
+            continue
+
+        values = to_values(item["data"], full=item["op"] == "update")
+        after = {**before, **values}
+        stat_changes.append((row_stat_key(after), 1))
+        # With version_id_col the ORM matches on the version read above and
+        # increments it, so a concurrent write makes the chunk roll back
+        updates.append({"id": item["id"], "version": before["version"], **values})
+        results[index] = {
+            "status": 200,
+            "data": {field: after[field] for field in USER_FIELDS},
+        }
+
+    if creates:
+        rows = [to_values(item["data"], full=True) for _, item in creates]
+        new_ids = session.execute(
+            insert(User).returning(User.id, sort_by_parameter_order=True), rows
+        ).scalars()
+        for (index, _), row, new_id in zip(creates, rows, new_ids):
+            data = {"id": new_id, **row}
+            stat_changes.append((row_stat_key(data), 1))
+            results[index] = {"status": 201, "data": data}
+
+    if updates:
+        session.execute(update(User), updates)
+    if deletes:
+        session.execute(delete(User).where(User.id.in_(deletes)))
+
+    apply_changes(stat_changes, session=session)
+    if creates or updates or deletes:
+        bump_users_version(conn=session)
+    return results, [values["id"] for values in updates] + deletes
+
+
+def run_batch(items, chunk_size):
+    # Execute validated (index, operation) pairs in chunks of chunk_size, each
+    # chunk in its own transaction, and return {index: result}
+    results = {}
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start : start + chunk_size]
+        try:
+            chunk_results, changed_ids = run_chunk(db.session, chunk)
+            db.session.commit()
+            invalidate_users(*changed_ids)
+            results.update(chunk_results)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error applying batch chunk at item %s: %s", chunk[0][0], e)
+            for index, _ in chunk:
+                results[index] = {"status": 500, "error": "Chunk rolled back"}
+    return results
@@ -0,0 +1,229 @@
+from collections import OrderedDict
+from flask import current_app
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "gen:users"
+
+
+class LRUCache:
+    # In-process LRU with a per-entry TTL; safe to share between threads
+    blocking = False
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        # Counters live outside the LRU so they are never evicted or expired
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    # Shared cache for multi-worker deployments, backed by a local SQLite file
+    # in WAL mode. Values are stored as JSON; expired rows are purged lazily.
+    PURGE_EVERY = 1000
+    # File I/O and lock waits: the async app calls it from a worker thread
+    blocking = True
+
+    def __init__(self, path, ttl=60):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._sets = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? AND expires >= ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + self.ttl),
+        )
+        self._sets += 1
+        if self._sets % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key):
+        row = (
+            self._connect()
+            .execute(
+                "INSERT INTO cache (key, value, expires) VALUES (?, '1', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 "
+                "RETURNING value",
+                (key, float("inf")),
+            )
+            .fetchone()
+        )
+        return int(row[0])
+
+    def get_counter(self, key):
+        row = (
+            self._connect()
+            .execute("SELECT value FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return int(row[0]) if row else 0
+
+    def __len__(self):
+        return (
+            self._connect()
+            .execute("SELECT COUNT(*) FROM cache WHERE expires >= ?", (time.time(),))
+            .fetchone()[0]
+        )
+
+
+class UserCache:
+    # Read-through cache for user reads. List pages are keyed by the users
+    # change counter their ETag is built from, so a write by any process
+    # retires them, and a page is never served under another version's ETag.
+    # Single users are invalidated per key; every write also bumps a
+    # generation counter so that fills are skipped when a write landed
+    # between the read and the fill.
+    def __init__(self, backend):
+        self.backend = backend
+        self.blocking = backend.blocking
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, value):
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def generation(self):
+        return self.backend.get_counter(GENERATION_KEY)
+
+    def get_user(self, user_id):
+        return self._count(self.backend.get(f"user:{user_id}"))
+
+    def set_user(self, user_id, data, generation):
+        if self.generation() == generation:
+            self.backend.set(f"user:{user_id}", data)
+
+    def list_key(self, params, version):
+        normalized = "&".join(
+            f"{name}={value.strip()}"
+            for name, value in sorted(params.items(multi=True))
+        )
+        return f"list:{version}:{normalized}"
+
+    def get_list(self, key):
+        return self._count(self.backend.get(key))
+
+    def set_list(self, key, body):
+        self.backend.set(key, body)
+
+    def invalidate(self, user_ids=()):
+        self.backend.incr(GENERATION_KEY)
+        for user_id in user_ids:
+            self.backend.delete(f"user:{user_id}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.backend),
+            "generation": self.generation(),
+        }
+
+
+def init_user_cache(app):
+    backend_name = app.config["USER_CACHE_BACKEND"]
+    ttl = app.config["USER_CACHE_TTL"]
+
+    if backend_name == "memory":
+        backend = LRUCache(maxsize=app.config["USER_CACHE_MAXSIZE"], ttl=ttl)
+    elif backend_name == "sqlite":
+        backend = SQLiteCache(os.path.abspath(app.config["USER_CACHE_PATH"]), ttl=ttl)
+    elif backend_name == "none":
+        backend = None
+    else:
+        raise ValueError(f"Unknown USER_CACHE_BACKEND: {backend_name}")
+
+    app.extensions["user_cache"] = UserCache(backend) if backend is not None else None
+    logger.info("User cache backend: %s", backend_name)
+
+
+def get_user_cache():
+    # None when caching is disabled
+    return current_app.extensions.get("user_cache")
+
+
+def invalidate_users(*user_ids):
+    cache = get_user_cache()
+    if cache:
+        cache.invalidate(user_ids)
@@ -0,0 +1,90 @@
+import json
+from sqlalchemy import func, select
+from etags import USERS_VERSION_QUERY
+from models import UserAgeCount
+from user_cache import LRUCache
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+class CountModeError(ValueError):
+    pass
+
+
+def parse_count_mode(value):
+    mode = value or "exact"
+    if mode not in COUNT_MODES:
+        raise CountModeError(
+            f"Invalid count: {mode}. Expected one of: {', '.join(COUNT_MODES)}"
+        )
+    return mode
+
+
+def exact_count(session, query):
+    return session.execute(
+        select(func.count()).select_from(query.order_by(None).subquery())
+    ).scalar()
+
+
+def maintained_total(session):
+    # Every user has an age, so the age histogram of the rollup sums to the
+    # row count; it is kept current in the same transaction as each write
+    return session.execute(
+        select(func.coalesce(func.sum(UserAgeCount.count), 0))
+    ).scalar()
+
+
+def planner_estimate(session, query):
+    # Row estimate of the top plan node, from PostgreSQL's table statistics
+    conn = session.connection()
+    sql = str(
+        query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    )
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):  # asyncpg does not decode json without a type
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def estimated_count(session, query, filtered):
+    # Returns (total, estimated). Unfiltered totals come from the rollup and
+    # are exact; filtered ones use the planner on PostgreSQL. SQLite keeps no
+    # statistics that can estimate these filters, so it counts exactly.
+    if not filtered:
+        return maintained_total(session), False
+    if session.get_bind().dialect.name == "postgresql":
+        return planner_estimate(session, query), True
+    return exact_count(session, query), False
+
+
+def count_users(session, query, mode, filters, cache=None):
+    # Returns (total, estimated) for the query built from the filters dict in
+    # "exact" or "estimate" mode. Cache keys embed the users change counter, which every
+    # write bumps, so a cached count is never served after a write.
+    key = None
+    if cache is not None:
+        version = session.execute(USERS_VERSION_QUERY).scalar() or 0
+        normalized = "&".join(
+            f"{name}={value}" for name, value in sorted(filters.items())
+        )
+        key = f"{mode}:{version}:{normalized}"
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if mode == "estimate":
+        result = estimated_count(session, query, bool(filters))
+    else:
+        result = exact_count(session, query), False
+
+    if key is not None:
+        cache.set(key, result)
+    return result
+
+
+def init_count_cache(app):
+    # Process-local; entries are keyed by data version, so they need no TTL
+    size = app.config["USER_COUNT_CACHE_SIZE"]
+    app.extensions["user_counts"] = (
+        LRUCache(maxsize=size, ttl=float("inf")) if size > 0 else None
+    )
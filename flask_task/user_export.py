@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from serializers import USER_FIELDS
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "users.ndjson"),
+    "csv": ("text/csv", "users.csv"),
+}
+
+
+def ndjson_chunk(rows, fields):
+    if orjson is not None:
+        return b"".join(orjson.dumps(dict(zip(fields, row))) + b"\n" for row in rows)
+    return "".join(
+        json.dumps(dict(zip(fields, row)), separators=(",", ":")) + "\n" for row in rows
+    ).encode()
+
+
+def csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def export_header(fmt, fields=USER_FIELDS):
+    return csv_chunk([fields]) if fmt == "csv" else b""
+
+
+def encode_rows(rows, fmt, fields=USER_FIELDS):
+    # rows come from select(*user_columns(fields))
+    return csv_chunk(rows) if fmt == "csv" else ndjson_chunk(rows, fields)
+
+
+def export_stream(session, query, fmt, batch_size, fields=USER_FIELDS):
+    # Rows are fetched batch_size at a time through a server-side cursor
+    # (yield_per), so memory stays flat however large the table is
+    result = session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        yield export_header(fmt, fields)
+        for rows in result.partitions():
+            yield encode_rows(rows, fmt, fields)
+    finally:
+        result.close()
+
+
+def export_headers(fmt):
+    # (mimetype, headers) of an export download in fmt
+    mimetype, filename = EXPORT_FORMATS[fmt]
+    return mimetype, {"Content-Disposition": f"attachment; filename={filename}"}
@@ -0,0 +1,215 @@
+from math import ceil
+from sqlalchemy import select
+from etags import user_etag
+from keyset import INT64, apply_keyset, encode_cursor, sort_column, sort_ordering
+from models import User
+from search_index import filter_by_terms
+from serializers import USER_FIELDS, serialize_row, serialize_rows, user_columns
+from user_counts import count_users
+
+# Read queries shared by the WSGI routes (run on db.session) and the ASGI app
+# (run through AsyncSession.run_sync). Each fetch_* takes a sync Session.
+
+
+# US zip codes have five digits; stored as integers, so without leading zeros
+ZIP_DIGITS = 5
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_filters(args):
+    # The non-empty list filters of a query string: search, city and state
+    # as strings, a zip prefix and the age_min/age_max bounds.
+    # Raises FilterError for a malformed zip prefix or age bound.
+    filters = {}
+    for name in ("search", "city", "state"):
+        value = args.get(name, default="", type=str).strip()
+        if value:
+            filters[name] = value
+
+    zip_prefix = args.get("zip", default="", type=str).strip()
+    if zip_prefix:
+        if (
+            not (zip_prefix.isascii() and zip_prefix.isdigit())
+            or len(zip_prefix) > ZIP_DIGITS
+        ):
+            raise FilterError(f"'zip' must be a prefix of up to {ZIP_DIGITS} digits")
+        filters["zip"] = zip_prefix
+
+    for name in ("age_min", "age_max"):
+        value = args.get(name, default="", type=str).strip()
+        if value:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise FilterError(f"'{name}' must be an integer") from None
+            if filters[name] not in INT64:
+                raise FilterError(f"'{name}' is out of range")
+    return filters
+
+
+def parse_ids(values, max_ids):
+    # User ids from "1,2,3".split(",") or a JSON array. Duplicates are dropped
+    # and the first occurrence keeps its position. Raises FilterError.
+    ids = {}
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise FilterError("'ids' must be integers")
+        try:
+            user_id = int(value)
+        except ValueError:
+            raise FilterError("'ids' must be comma-separated integers") from None
+        if user_id not in INT64:
+            raise FilterError(f"Id out of range: {value}")
+        ids[user_id] = None
+    if not ids:
+        raise FilterError("'ids' must not be empty")
+    if len(ids) > max_ids:
+        raise FilterError(f"At most {max_ids} ids per request")
+    return list(ids)
+
+
+def zip_range(prefix):
+    # "80" -> (80000, 80999): a prefix of the five-digit code is a range of
+    # the integer column, which the (zip, id) index can seek
+    scale = 10 ** (ZIP_DIGITS - len(prefix))
+    low = int(prefix) * scale
+    return low, low + scale - 1
+
+
+def filtered_users(filters, backend=None, fields=USER_FIELDS):
+    # filters as returned by parse_filters. Only the requested columns are
+    # selected; state, zip and age are index range conditions.
+    query = select(*user_columns(fields))
+    if "search" in filters:
+        query = filter_by_terms(
+            query, filters["search"], ("first_name", "last_name"), backend
+        )
+    if "city" in filters:
+        query = filter_by_terms(query, filters["city"], ("city",), backend)
+    if "state" in filters:
+        query = query.where(User.state == filters["state"])
+    if "zip" in filters:
+        query = query.where(User.zip.between(*zip_range(filters["zip"])))
+    if "age_min" in filters:
+        query = query.where(User.age >= filters["age_min"])
+    if "age_max" in filters:
+        query = query.where(User.age <= filters["age_max"])
+    return query
+
+
+def fetch_users_by_ids(session, ids, chunk_size, fields=USER_FIELDS):
+    # One IN query per chunk_size ids. Users come back in the order of ids;
+    # ids that do not exist are listed under "missing".
+    query = select(*user_columns(fields))
+    found = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start : start + chunk_size]
+        for row in session.execute(query.where(User.id.in_(chunk))):
+            found[row.id] = row
+    return {
+        "data": serialize_rows([found[i] for i in ids if i in found], fields),
+        "missing": [i for i in ids if i not in found],
+    }
+
+
+def fetch_cursor_page(session, query, sort, cursor, limit, fields=USER_FIELDS):
+    # Keyset mode: seek past the cursor and skip the COUNT(*) entirely.
+    # Raises KeysetError for an unknown sort field or a bad cursor.
+    column, _ = sort_column(sort)
+    if column.key not in fields:
+        # The next cursor needs the sort key; it is selected but not returned
+        query = query.add_columns(column)
+    query = apply_keyset(query, sort, cursor)
+    rows = session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "data": serialize_rows(rows, fields),
+        "limit": limit,
+        "next_cursor": encode_cursor(sort, rows[-1]) if has_more else None,
+    }
+
+
+def fetch_offset_page(
+    session,
+    query,
+    sort,
+    page,
+    limit,
+    fields=USER_FIELDS,
+    count="exact",
+    filters=None,
+    count_cache=None,
+):
+    # Raises KeysetError for a sort field that is not in SORTABLE_FIELDS.
+    # count="none" skips the total and reports has_next instead.
+    query = query.order_by(*sort_ordering(sort))
+
+    # Same page/limit clamping as Flask-SQLAlchemy's paginate(error_out=False)
+    page = max(page, 1)
+    limit = limit if limit >= 1 else 20
+    offset = (page - 1) * limit
+
+    if count == "none":
+        rows = session.execute(query.limit(limit + 1).offset(offset)).all()
+        return {
+            "data": serialize_rows(rows[:limit], fields),
+            "page": page,
+            "limit": limit,
+            "has_next": len(rows) > limit,
+        }
+
+    total, estimated = count_users(session, query, count, filters or {}, count_cache)
+    rows = session.execute(query.limit(limit).offset(offset)).all()
+
+    body = {
+        "data": serialize_rows(rows, fields),
+        "page": page,
+        "limit": limit,
+        "total_pages": ceil(total / limit) if total else 0,
+        "total_users": total,
+    }
+    if count == "estimate":
+        body["total_estimated"] = estimated
+    return body
+
+
+def fetch_user_list(session, params, chunk_size, backend=None, count_cache=None):
+    # The GET /users body for params as returned by user_api.parse_list_request:
+    # a multi-get when ids are given, else a keyset or offset page.
+    # Raises KeysetError for a bad cursor.
+    fields = params["fields"]
+    if params["ids"] is not None:
+        return fetch_users_by_ids(session, params["ids"], chunk_size, fields)
+
+    query = filtered_users(params["filters"], backend, fields)
+    if params["cursor"] is not None:
+        return fetch_cursor_page(
+            session, query, params["sort"], params["cursor"], params["limit"], fields
+        )
+    return fetch_offset_page(
+        session,
+        query,
+        params["sort"],
+        params["page"],
+        params["limit"],
+        fields,
+        params["count"],
+        params["filters"],
+        count_cache,
+    )
+
+
+def fetch_user(session, user_id, fields=USER_FIELDS):
+    # {"data": serialized user, "etag": ETag of the full user}, the entry
+    # format of the user cache, or None when the user does not exist
+    row = session.execute(
+        select(*user_columns(fields), User.version).where(User.id == user_id)
+    ).one_or_none()
+    if row is None:
+        return None
+    return {"data": serialize_row(row, fields), "etag": user_etag(user_id, row.version)}
@@ -0,0 +1,342 @@
+from sqlalchemy import func, select
+from etags import USERS_VERSION_QUERY
+from models import User
+from user_queries import ZIP_DIGITS, zip_range
+import math
+import sys
+import threading
+import time
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# In-process columnar copy of the users table for /users/analytics. Ages and
+# zips are NumPy arrays and city/state are dictionary-encoded (int32 codes
+# into a list of names), so group-by counts, age statistics and histograms
+# are vectorized over a few MB instead of scanning the table. Ages and zips
+# are int64 like the columns and are only counted per distinct value, so a
+# stray huge value neither overflows nor sizes an array.
+
+SNAPSHOT_COLUMNS = (User.id, User.version, User.age, User.zip, User.city, User.state)
+GROUP_BY = ("city", "state", "zip")
+ZIP_PREFIX_DIGITS = 3
+# Code/value stored for a NULL age, zip, city or state
+MISSING = -1
+# Ids per block compared on a refresh; a changed block is reloaded whole
+BLOCK_SIZE = 1024
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def parse_group_by(value):
+    if value and value not in GROUP_BY:
+        raise AnalyticsError(
+            f"Invalid group_by: {value}. Expected one of: {', '.join(GROUP_BY)}"
+        )
+    return value or None
+
+
+def parse_bin_width(value):
+    try:
+        width = int(value or 10)
+    except ValueError:
+        raise AnalyticsError("'bin_width' must be a positive integer") from None
+    if width < 1:
+        raise AnalyticsError("'bin_width' must be a positive integer")
+    return width
+
+
+class Dictionary:
+    # Append-only name -> code mapping. Names whose users are all gone keep
+    # their code and simply count 0.
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def encode(self, values):
+        def code(value):
+            if value is None:
+                return MISSING
+            found = self.codes.get(value)
+            if found is None:
+                found = self.codes[value] = len(self.names)
+                self.names.append(value)
+            return found
+
+        return np.fromiter(map(code, values), np.int32, count=len(values))
+
+    def nbytes(self):
+        return (
+            sys.getsizeof(self.names)
+            + sys.getsizeof(self.codes)
+            + sum(sys.getsizeof(name) for name in self.names)
+        )
+
+
+def integer_column(rows, index, dtype):
+    # np.array() on a list of Rows goes through the sequence protocol per
+    # row and is ~250x slower than this
+    return np.fromiter(
+        (MISSING if row[index] is None else row[index] for row in rows),
+        dtype,
+        count=len(rows),
+    )
+
+
+def empty_columns():
+    return {
+        "id": np.empty(0, np.int64),
+        "version": np.empty(0, np.int64),
+        "age": np.empty(0, np.int64),
+        "zip": np.empty(0, np.int64),
+        "city": np.empty(0, np.int32),
+        "state": np.empty(0, np.int32),
+    }
+
+
+def stale_blocks(columns, blocks):
+    # blocks: (block, count, version sum, id sum) rows for the users table,
+    # where a block is id // BLOCK_SIZE. An update raises its block's version
+    # sum, a delete lowers its count and an insert raises it; a delete plus
+    # an insert in the same block keeps count and version sum but moves the
+    # id sum, as the new row has a new id. Blocks that differ from the
+    # snapshot (or are gone from the table) are the ones to reload.
+    #
+    # SQLite can hand out the highest ids again after they are deleted, and
+    # such a row may match the old one in all three sums, so the last block
+    # is always reloaded. Only a reused run of top ids reaching below the
+    # last block between two refreshes goes unnoticed; PostgreSQL sequences
+    # never reuse ids.
+    block_ids = integer_column(blocks, 0, np.int64)
+    counts = integer_column(blocks, 1, np.int64)
+    version_sums = integer_column(blocks, 2, np.int64)
+    id_sums = integer_column(blocks, 3, np.int64)
+
+    known = columns["id"] // BLOCK_SIZE
+    size = int(max(known.max(initial=-1), block_ids.max(initial=-1))) + 1
+    known_counts = np.bincount(known, minlength=size)
+    known_versions = np.bincount(known, weights=columns["version"], minlength=size)
+    known_ids = np.bincount(known, weights=columns["id"], minlength=size)
+    changed = (
+        (known_counts[block_ids] != counts)
+        | (known_versions[block_ids] != version_sums)
+        | (known_ids[block_ids] != id_sums)
+    )
+
+    gone = np.ones(size, dtype=bool)
+    gone[block_ids] = False
+    gone &= known_counts > 0
+    stale = [block_ids[changed], np.flatnonzero(gone)]
+    if len(block_ids):
+        stale.append(block_ids.max(keepdims=True))
+    return np.unique(np.concatenate(stale))
+
+
+def block_ranges(blocks):
+    # Sorted block numbers -> (first id, last id) of each run of adjacent blocks
+    runs = np.split(blocks, np.flatnonzero(np.diff(blocks) != 1) + 1)
+    return [
+        (int(run[0]) * BLOCK_SIZE, (int(run[-1]) + 1) * BLOCK_SIZE - 1)
+        for run in runs
+        if len(run)
+    ]
+
+
+class UserSnapshot:
+    # One per process, shared by all request threads. refresh() swaps in a
+    # new set of arrays, so a reader always sees a complete snapshot.
+    def __init__(self):
+        self.columns = empty_columns()
+        self.cities = Dictionary()
+        self.states = Dictionary()
+        self.users_version = None
+        self.last_refresh = None
+        self._lock = threading.Lock()
+
+    def refresh(self, session):
+        # Returns True when the snapshot changed. While the users change
+        # counter stays the same this is a single primary key lookup.
+        with self._lock:
+            users_version = session.execute(USERS_VERSION_QUERY).scalar() or 0
+            if users_version == self.users_version:
+                return False
+
+            started = time.perf_counter()
+            current = self.columns
+            keep, rows = self._changes(session, current)
+            fresh = self._encode(rows)
+            merged = {
+                name: np.concatenate([current[name][keep], fresh[name]])
+                for name in current
+            }
+            order = np.argsort(merged["id"], kind="stable")
+            self.columns = {name: column[order] for name, column in merged.items()}
+            self.users_version = users_version
+            self.last_refresh = {
+                "rows_fetched": len(rows),
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            logger.debug(
+                "User snapshot refreshed: %d rows fetched in %.1fms",
+                len(rows),
+                self.last_refresh["ms"],
+            )
+            return True
+
+    def _changes(self, session, current):
+        # (positions of snapshot rows to keep, rows to add). One grouped
+        # aggregate finds the blocks of ids that changed, then only those
+        # id ranges are read; a first load, or one where most of the table
+        # changed, reads everything.
+        everything = select(*SNAPSHOT_COLUMNS)
+        if not len(current["id"]):
+            return np.empty(0, np.intp), session.execute(everything).all()
+
+        block = (User.id // BLOCK_SIZE).label("block")
+        blocks = session.execute(
+            select(
+                block, func.count(), func.sum(User.version), func.sum(User.id)
+            ).group_by(block)
+        ).all()
+        stale = stale_blocks(current, blocks)
+        if len(stale) > len(blocks) // 2:
+            return np.empty(0, np.intp), session.execute(everything).all()
+
+        keep = np.flatnonzero(~np.isin(current["id"] // BLOCK_SIZE, stale))
+        rows = []
+        for first, last in block_ranges(stale):
+            rows.extend(session.execute(everything.where(User.id.between(first, last))))
+        return keep, rows
+
+    def _encode(self, rows):
+        return {
+            "id": integer_column(rows, 0, np.int64),
+            "version": integer_column(rows, 1, np.int64),
+            "age": integer_column(rows, 2, np.int64),
+            "zip": integer_column(rows, 3, np.int64),
+            "city": self.cities.encode([row[4] for row in rows]),
+            "state": self.states.encode([row[5] for row in rows]),
+        }
+
+    def nbytes(self):
+        columns = self.columns
+        return (
+            sum(column.nbytes for column in columns.values())
+            + self.cities.nbytes()
+            + self.states.nbytes()
+        )
+
+    def stats(self):
+        return {
+            "rows": len(self.columns["id"]),
+            "memory_bytes": self.nbytes(),
+            "users_version": self.users_version,
+            "last_refresh": self.last_refresh,
+        }
+
+    def analyze(self, filters, group_by=None, bin_width=10):
+        # filters: the state, zip, age_min and age_max keys of parse_filters.
+        # Reads self.columns once, so a concurrent refresh cannot mix two
+        # versions of the table into one answer.
+        columns = self.columns
+        mask = self._filter(columns, filters)
+
+        def column(name):
+            return columns[name] if mask is None else columns[name][mask]
+
+        ages = column("age")
+        ages, per_age = np.unique(ages[ages >= 0], return_counts=True)
+        result = {
+            "total": len(columns["id"]) if mask is None else int(mask.sum()),
+            "age": age_stats(ages, per_age),
+            "age_histogram": age_histogram(ages, per_age, bin_width),
+        }
+        if group_by:
+            result["groups"] = self.group_counts(group_by, column(group_by))
+        return result
+
+    def _filter(self, columns, filters):
+        # Boolean mask of the matching rows, or None when nothing is filtered
+        if not filters:
+            return None
+        mask = np.ones(len(columns["id"]), dtype=bool)
+        if "state" in filters:
+            code = self.states.codes.get(filters["state"], MISSING)
+            mask &= (columns["state"] == code) & (code != MISSING)
+        if "zip" in filters:
+            low, high = zip_range(filters["zip"])
+            mask &= (columns["zip"] >= low) & (columns["zip"] <= high)
+        if "age_min" in filters:
+            mask &= columns["age"] >= max(filters["age_min"], 0)
+        if "age_max" in filters:
+            mask &= (columns["age"] <= filters["age_max"]) & (columns["age"] >= 0)
+        return mask
+
+    def group_counts(self, kind, values):
+        # [{"name", "count"}] for one column of the matching rows, largest
+        # groups first; zips are grouped by their 3-digit prefix
+        values = values[values >= 0]
+        if kind == "zip":
+            prefixes, counts = np.unique(
+                values // 10 ** (ZIP_DIGITS - ZIP_PREFIX_DIGITS), return_counts=True
+            )
+            names = [f"{prefix:0{ZIP_PREFIX_DIGITS}d}" for prefix in prefixes]
+        else:
+            names = (self.cities if kind == "city" else self.states).names
+            counts = np.bincount(values, minlength=len(names))
+        present = np.flatnonzero(counts)
+        present = present[np.argsort(-counts[present], kind="stable")]
+        return [{"name": names[i], "count": int(counts[i])} for i in present]
+
+
+def age_stats(ages, per_age):
+    # ages: the distinct ages in ascending order, per_age: users of each.
+    # There are few distinct ages, so everything comes from these counts
+    # instead of sorting the ages; percentiles are nearest-rank.
+    total = int(per_age.sum())
+    if not total:
+        return None
+    cumulative = np.cumsum(per_age)
+    p50, p90 = np.searchsorted(
+        cumulative, [math.ceil(total * 0.5), math.ceil(total * 0.9)]
+    )
+    return {
+        "min": int(ages[0]),
+        "max": int(ages[-1]),
+        "mean": round(float(np.dot(ages.astype(float), per_age)) / total, 2),
+        "p50": int(ages[p50]),
+        "p90": int(ages[p90]),
+    }
+
+
+def age_histogram(ages, per_age, bin_width):
+    # One entry per non-empty bin; ages are sorted, so each bin is a run
+    if not len(ages):
+        return []
+    bins, starts = np.unique(ages // bin_width, return_index=True)
+    counts = np.add.reduceat(per_age, starts)
+    return [
+        {
+            "from": int(i) * bin_width,
+            "to": (int(i) + 1) * bin_width - 1,
+            "count": int(c),
+        }
+        for i, c in zip(bins, counts)
+    ]
+
+
+def init_user_snapshot(app):
+    snapshot = None
+    if app.config["USER_SNAPSHOT_ENABLED"]:
+        if np is None:
+            logger.warning("numpy is not installed, user snapshot disabled")
+        else:
+            snapshot = UserSnapshot()
+    app.extensions["user_snapshot"] = snapshot
@@ -0,0 +1,117 @@
+from collections import Counter
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select
+from models import User, UserAgeCount, UserGroupCount
+from db_util import db, increment_counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+GROUP_KINDS = ("city", "state")
+
+
+def stat_key(user):
+    # Snapshot of the fields the rollup depends on, taken before a mutation
+    return {"city": user.city, "state": user.state, "age": user.age}
+
+
+def row_stat_key(row):
+    # Same as stat_key for a plain column mapping (Core rows, payload dicts)
+    return {"city": row["city"], "state": row["state"], "age": row["age"]}
+
+
+def apply_changes(changes, session=None):
+    # changes is an iterable of (stat_key, delta) pairs; deltas are merged
+    # per counter so a batch touches each rollup row at most once
+    groups, ages = Counter(), Counter()
+    for key, delta in changes:
+        for kind in GROUP_KINDS:
+            if key[kind] is not None:
+                groups[(kind, key[kind])] += delta
+        if key["age"] is not None:
+            ages[int(key["age"])] += delta
+
+    for (kind, name), delta in groups.items():
+        if delta:
+            increment_counter(
+                UserGroupCount, {"kind": kind, "name": name}, delta, conn=session
+            )
+    for age, delta in ages.items():
+        if delta:
+            increment_counter(UserAgeCount, {"age": age}, delta, conn=session)
+
+
+def read_summary(session=None):
+    session = session or db.session
+    group_rows = session.execute(
+        select(UserGroupCount.kind, UserGroupCount.name, UserGroupCount.count).where(
+            UserGroupCount.count > 0
+        )
+    ).all()
+    age_rows = session.execute(
+        select(UserAgeCount.age, UserAgeCount.count).where(UserAgeCount.count > 0)
+    ).all()
+
+    counts = {kind: {} for kind in GROUP_KINDS}
+    for kind, name, count in group_rows:
+        counts[kind][name] = count
+
+    total = sum(count for _, count in age_rows)
+    age_sum = sum(age * count for age, count in age_rows)
+    ages = [age for age, _ in age_rows]
+
+    return {
+        "count_by_city": counts["city"],
+        "count_by_state": counts["state"],
+        "avg_age": round(age_sum / total, 2) if total else None,
+        "max_age": max(ages) if ages else None,
+        "min_age": min(ages) if ages else None,
+    }
+
+
+def rebuild_stats():
+    # Recompute the rollup from the users table in a single transaction
+    db.session.execute(delete(UserGroupCount))
+    db.session.execute(delete(UserAgeCount))
+
+    for kind in GROUP_KINDS:
+        column = getattr(User, kind)
+        rows = db.session.execute(
+            select(column, func.count(User.id))
+            .where(column.is_not(None))
+            .group_by(column)
+        ).all()
+        if rows:
+            db.session.execute(
+                insert(UserGroupCount),
+                [{"kind": kind, "name": name, "count": count} for name, count in rows],
+            )
+
+    rows = db.session.execute(
+        select(User.age, func.count(User.id))
+        .where(User.age.is_not(None))
+        .group_by(User.age)
+    ).all()
+    if rows:
+        db.session.execute(
+            insert(UserAgeCount), [{"age": age, "count": count} for age, count in rows]
+        )
+
+    db.session.commit()
+    logger.info("User statistics rollup rebuilt")
+
+
+def stats_missing():
+    # True when users exist but the rollup has never been built
+    has_users = db.session.execute(select(User.id).limit(1)).first()
+    has_stats = db.session.execute(select(UserAgeCount.age).limit(1)).first()
+    return bool(has_users) and not has_stats
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the /users/summary rollup from the users table."""
+    rebuild_stats()
+    click.echo("User statistics rebuilt.")
@@ -0,0 +1,138 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm.exc import StaleDataError
+from models import User
+from etags import bump_users_version, etag_matches, user_etag
+from serializers import USER_COLUMNS, serialize_row, serialize_user
+from user_stats import GROUP_KINDS, apply_changes, row_stat_key, stat_key
+
+# Single-user writes; updates and deletes are one UPDATE/DELETE ... RETURNING
+# instead of loading an ORM object first. Shared by the WSGI routes and the
+# ASGI app (through AsyncSession.run_sync); the caller commits, or rolls back
+# on False.
+
+STAT_FIELDS = (*GROUP_KINDS, "age")
+RETURNED_COLUMNS = (*USER_COLUMNS, User.version)
+
+
+def returns_previous_values(dialect):
+    # PostgreSQL can RETURN columns of an UPDATE's FROM subquery, which gives
+    # the pre-update rollup fields in the same statement; SQLite cannot
+    return dialect.update_returning and dialect.name == "postgresql"
+
+
+def insert_user(session, values):
+    # values as returned by to_values(full=True). Returns (serialized user,
+    # ETag); the flush assigns the id and the initial version.
+    user = User(**values)
+    session.add(user)
+    session.flush()
+    apply_changes([(stat_key(user), 1)], session=session)
+    bump_users_version(conn=session)
+    return serialize_user(user), user_etag(user.id, user.version)
+
+
+def update_user_row(session, user_id, values, if_match=None):
+    # values as returned by to_values(). Returns None when the user does not
+    # exist and False when if_match does not hold the ETag of the replaced
+    # version; otherwise (serialized user, new ETag). The ETag is checked
+    # against version - 1 of the returned row, since this statement is what
+    # incremented it.
+    stats_changed = bool(values.keys() & set(STAT_FIELDS))
+    dialect = session.get_bind().dialect
+    if values and dialect.update_returning:
+        if not stats_changed or returns_previous_values(dialect):
+            return _update_returning(session, user_id, values, if_match, stats_changed)
+
+    # Fallback: read the row, then update it only if it still has that version
+    row = session.execute(
+        select(*RETURNED_COLUMNS).where(User.id == user_id)
+    ).one_or_none()
+    if row is None:
+        return None
+    if if_match and not etag_matches(if_match, user_etag(user_id, row.version)):
+        return False
+    before = serialize_row(row)
+    if not values:
+        return before, user_etag(user_id, row.version)
+
+    result = session.execute(
+        update(User)
+        .where(User.id == user_id, User.version == row.version)
+        .values(**values, version=row.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise StaleDataError(f"User {user_id} was modified concurrently")
+    after = {**before, **values}
+    _record_update(session, row_stat_key(before), row_stat_key(after))
+    return after, user_etag(user_id, row.version + 1)
+
+
+def _update_returning(session, user_id, values, if_match, stats_changed):
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(**values, version=User.version + 1)
+        .returning(*RETURNED_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    if stats_changed:
+        # FOR UPDATE makes the subquery wait for concurrent writers and read
+        # the row as this UPDATE replaces it
+        previous = (
+            select(User.id, *(getattr(User, field) for field in STAT_FIELDS))
+            .where(User.id == user_id)
+            .with_for_update()
+            .subquery("previous")
+        )
+        stmt = stmt.where(User.id == previous.c.id).returning(
+            *(previous.c[field].label(f"previous_{field}") for field in STAT_FIELDS)
+        )
+
+    row = session.execute(stmt).one_or_none()
+    if row is None:
+        return None
+    if if_match and not etag_matches(if_match, user_etag(user_id, row.version - 1)):
+        return False
+
+    after = serialize_row(row)
+    if stats_changed:
+        before = {field: row._mapping[f"previous_{field}"] for field in STAT_FIELDS}
+        _record_update(session, before, row_stat_key(after))
+    else:
+        bump_users_version(conn=session)
+    return after, user_etag(user_id, row.version)
+
+
+def _record_update(session, before, after):
+    if before != after:
+        apply_changes([(before, -1), (after, 1)], session=session)
+    bump_users_version(conn=session)
+
+
+def delete_user_row(session, user_id):
+    # Returns False when the user does not exist
+    stat_columns = [getattr(User, field) for field in STAT_FIELDS]
+    if session.get_bind().dialect.delete_returning:
+        row = session.execute(
+            delete(User)
+            .where(User.id == user_id)
+            .returning(*stat_columns)
+            .execution_options(synchronize_session=False)
+        ).one_or_none()
+    else:
+        row = session.execute(
+            select(*stat_columns).where(User.id == user_id)
+        ).one_or_none()
+        if row is not None:
+            session.execute(
+                delete(User)
+                .where(User.id == user_id)
+                .execution_options(synchronize_session=False)
+            )
+    if row is None:
+        return False
+
+    apply_changes([(row_stat_key(row._mapping), -1)], session=session)
+    bump_users_version(conn=session)
+    return True